@@ -1,6 +1,7 @@
-from aqt import mw
+from aqt import mw, gui_hooks
 from aqt.qt import QAction
 from importlib import reload
+from .core.splitter import shutdownSplitterPool
 
 def main():
     from . import importer
@@ -11,3 +12,5 @@ action = QAction('Import Smart Kindle highlights...', mw)
 action.setShortcut("Ctrl+K")
 action.triggered.connect(main)
 mw.form.menuTools.addAction(action)
+
+gui_hooks.profile_will_close.append(shutdownSplitterPool)
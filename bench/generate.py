@@ -0,0 +1,139 @@
+# Synthetic Kindle data for the benchmark harness. Writes a My Clippings.txt,
+# a Kindle vocab.db and a jmdict-style dictionary that look like a real
+# Japanese reader's: highlights follow the Vocab Builder lookup they came from
+# by a few seconds, books are spread over many titles, and some records are
+# bookmarks, unmatched highlights or malformed.
+#
+#   python bench/generate.py 10000 /tmp/kindle-10k
+import argparse
+import os
+import random
+import sqlite3
+from datetime import datetime
+
+KANJI = [chr(c) for c in range(0x4E00, 0x4E00 + 3000)]
+KANA = 'あいうえおかきくけこさしすせそたちつてとなにぬねのはひふへほまみむめもやゆよらりるれろわ'
+WEEKDAYS = '月火水木金土日'
+# dictionary ending, past tense ending
+VERB_ENDINGS = [('る', 'た'), ('う', 'った'), ('く', 'いた'), ('す', 'した'), ('む', 'んだ'), ('る', 'て')]
+START = 1546300800  # 2019-01-01
+
+
+def makeLexicon(rng, size):
+    # (dictionary form, form as read in a book, reading)
+    lexicon = []
+    seen = set()
+    while len(lexicon) < size:
+        stem = ''.join(rng.choice(KANJI) for _ in range(rng.randint(1, 2)))
+        reading = ''.join(rng.choice(KANA) for _ in range(rng.randint(2, 5)))
+        if rng.random() < 0.5:
+            entry = (stem, stem, reading)
+        else:
+            dictionaryEnding, pastEnding = rng.choice(VERB_ENDINGS)
+            entry = (stem + dictionaryEnding, stem + pastEnding, reading + dictionaryEnding)
+        if entry[0] not in seen:
+            seen.add(entry[0])
+            lexicon.append(entry)
+    return lexicon
+
+
+def makeBooks(rng, count):
+    return [('book-%d' % i, '作品%d %s' % (i, ''.join(rng.choice(KANJI) for _ in range(3))), '作者%d' % (i % 97)) for i in range(count)]
+
+
+def filler(rng, length):
+    return ''.join(rng.choice(KANA) if rng.random() < 0.7 else rng.choice(KANJI) for _ in range(length))
+
+
+def makeLookups(rng, size, lexicon, books):
+    # (id, word_key, book_key, usage, timestamp in ms, form as read)
+    timestamp = START
+    lookups = []
+    for i in range(size):
+        timestamp += rng.randint(10, 900)
+        book = rng.choice(books)
+        _, form, _ = rng.choice(lexicon)
+        usage = '%s%s%s。' % (filler(rng, rng.randint(5, 40)), form, filler(rng, rng.randint(5, 40)))
+        lookups.append(('lookup-%d' % i, 'ja:' + form, book[0], usage, timestamp * 1000, form))
+    return lookups
+
+
+def writeVocabDb(path, lookups, books):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if os.path.exists(path):
+        os.remove(path)
+    conn = sqlite3.connect(path)
+    conn.executescript('''
+    CREATE TABLE WORDS (id TEXT PRIMARY KEY NOT NULL UNIQUE, word TEXT, stem TEXT, lang TEXT, category INTEGER DEFAULT 0, timestamp INTEGER DEFAULT 0, profileid TEXT);
+    CREATE TABLE LOOKUPS (id TEXT PRIMARY KEY NOT NULL, word_key TEXT, book_key TEXT, dict_key TEXT, pos TEXT, usage TEXT, timestamp INTEGER DEFAULT 0);
+    CREATE TABLE BOOK_INFO (id TEXT PRIMARY KEY NOT NULL, asin TEXT, guid TEXT, lang TEXT, title TEXT, authors TEXT);
+    ''')
+    conn.executemany('INSERT INTO BOOK_INFO VALUES (?, ?, ?, ?, ?, ?)', [(key, '', '', 'ja', title, authors) for key, title, authors in books])
+    conn.executemany('INSERT OR IGNORE INTO WORDS VALUES (?, ?, ?, ?, 0, ?, ?)', [(wordKey, form, form, 'ja', timestamp, '') for _, wordKey, _, _, timestamp, form in lookups])
+    conn.executemany('INSERT INTO LOOKUPS VALUES (?, ?, ?, ?, ?, ?, ?)', [(id, wordKey, bookKey, '', '0', usage, timestamp) for id, wordKey, bookKey, usage, timestamp, _ in lookups])
+    conn.commit()
+    conn.close()
+
+
+def clippingRecord(title, authors, page, kind, added, content):
+    added = datetime.fromtimestamp(added)
+    return '%s (%s)\r\n- %dページ|位置No. %d-%dの%s |作成日: %d年%d月%d日%s曜日 %d:%02d:%02d\r\n\r\n%s\r\n==========\r\n' % (
+        title, authors, page, page * 15, page * 15 + 1, kind,
+        added.year, added.month, added.day, WEEKDAYS[added.weekday()], added.hour, added.minute, added.second,
+        content)
+
+
+def writeClippings(path, rng, size, lookups, books):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    titles = {key: (title, authors) for key, title, authors in books}
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        f.write('\ufeff')
+        for i in range(size):
+            _, _, bookKey, usage, timestamp, form = lookups[i % len(lookups)]
+            title, authors = titles[bookKey]
+            added = timestamp // 1000 + rng.randint(2, 90)
+            roll = rng.random()
+            if roll < 0.03:
+                f.write(clippingRecord(title, authors, i % 400, 'ブックマーク', added, ''))
+            elif roll < 0.05:
+                f.write(clippingRecord(title, authors, i % 400, 'ハイライト', added, filler(rng, 4)))
+            elif roll < 0.06:
+                f.write('%s\r\n壊れた記録\r\n==========\r\n' % title)
+            else:
+                # highlights often drag in a stray punctuation mark
+                content = form + ('、' if rng.random() < 0.1 else '')
+                f.write(clippingRecord(title, authors, i % 400, 'ハイライト', added, content))
+
+
+def writeDictionary(path, lexicon):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        for expression, _, reading in lexicon:
+            f.write('%s\t%s\t\n' % (expression, reading))
+
+
+def generate(size, root, seed=0):
+    # size clippings and size lookups, laid out under root like a Kindle's drive
+    rng = random.Random(seed)
+    lexicon = makeLexicon(rng, max(200, size // 5))
+    books = makeBooks(rng, max(5, size // 200))
+    lookups = makeLookups(rng, size, lexicon, books)
+    paths = {
+        'kindle': root,
+        'clippings': os.path.join(root, 'documents', 'My Clippings.txt'),
+        'vocab': os.path.join(root, 'system', 'vocabulary', 'vocab.db'),
+        'dictionary': os.path.join(root, 'jmdict_freqs.txt'),
+    }
+    writeVocabDb(paths['vocab'], lookups, books)
+    writeClippings(paths['clippings'], rng, size, lookups, books)
+    writeDictionary(paths['dictionary'], lexicon)
+    return paths
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write a synthetic Kindle dataset')
+    parser.add_argument('size', type=int)
+    parser.add_argument('root')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    print(generate(args.size, args.root, args.seed))
@@ -0,0 +1,248 @@
+# Times each stage of an import over synthetic Kindle data and writes the
+# results as JSON, so runs before and after a change can be compared.
+#
+#   python bench/run.py --sizes 1000 10000 100000
+#   python bench/run.py --sizes 10000 --compare bench/results/before.json
+#
+# The stages call the Anki-free core directly; the add-on's importer is only
+# loaded, over stub anki and aqt modules, to write notes and for the full
+# import. Every stage is run twice from a clean start: once for time and once under
+# tracemalloc for peak memory, so tracing doesn't slow the timings down.
+# MeCab is left out so results don't depend on it being installed: words the
+# dictionary and the deconjugation rules can't place are passed through as
+# they are.
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+from datetime import datetime
+from functools import partial
+
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+import generate
+import stubs
+
+ADDON_MODULES = {
+    'clippings': 'core.clippings',
+    'lookups': 'core.lookups',
+    'mirror': 'core.mirror',
+    'notes': 'core.notes',
+    'pipeline': 'core.pipeline',
+    'splitter': 'core.splitter',
+    'vocab': 'core.vocab',
+    'importer': 'importer',
+}
+STAGES = ('parse', 'sql_load', 'match', 'clean_vocab', 'notes', 'end_to_end')
+
+
+def timed(results, stage, fn, items=len):
+    start = time.perf_counter()
+    value = fn()
+    seconds = time.perf_counter() - start
+    count = items(value)
+    results[stage] = {'seconds': seconds, 'items': count, 'items_per_second': count / seconds if seconds else None}
+    return value
+
+
+def traced(results, stage, fn, items=len):
+    tracemalloc.start()
+    try:
+        value = fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    results[stage] = {'peak_bytes': peak}
+    return value
+
+
+def resetState(addon, mw, paths):
+    for path in (addon.importer.MIRROR_PATH, addon.importer.JOURNAL_PATH):
+        if os.path.exists(path):
+            os.remove(path)
+    addon.importer.CONFIG.update(path=paths['kindle'], last_added=None, clippings_checkpoint=None)
+    mw.col.reset()
+
+
+def runPipeline(addon, mw, paths, words, measure):
+    # The stages go straight to core; only writing notes and the full import
+    # need the add-on and the stub collection
+    resetState(addon, mw, paths)
+    results = {}
+    config = addon.importer.CONFIG
+    mirrorPath = addon.importer.MIRROR_PATH
+    fieldNames = mw.col.models.fieldNames(mw.col.model)
+    since = addon.lookups.getLookupsSince(config['last_added'])
+
+    stats = addon.clippings.ClippingStats()
+    clippings = measure(results, 'parse', lambda: list(addon.clippings.getClippings(paths['clippings'], stats)))
+
+    def loadLookups():
+        addon.lookups.syncVocabLookups(mirrorPath, paths['kindle'])
+        return list(addon.lookups.iterVocabLookups(mirrorPath, since))
+    measure(results, 'sql_load', loadLookups)
+
+    def matchAll():
+        conn = addon.mirror.openMirror(mirrorPath)
+        try:
+            books = addon.mirror.BookIndex(conn)
+            lookups = partial(addon.lookups.iterVocabLookups, mirrorPath, since)
+            window = config['mins_since_lookup'] * 60
+            found = []
+            leftovers = []
+            for chunk in addon.clippings.chunked(clippings, config['chunk_size']):
+                for clipping, candidates in zip(chunk, addon.lookups.matchClippings(chunk, books, lookups, window)):
+                    if candidates:
+                        found.append((clipping, candidates))
+                    else:
+                        leftovers.append(clipping)
+            if leftovers:
+                found.extend(zip(leftovers, addon.lookups.matchLeftovers(leftovers, books, lookups)))
+            matched = []
+            for clipping, candidates in found:
+                vocab = addon.lookups.closestVocab(candidates)
+                if vocab:
+                    matched.append((clipping, vocab))
+            return matched
+        finally:
+            conn.close()
+    matched = measure(results, 'match', matchAll, items=lambda value: len(clippings))
+
+    def cleanAll():
+        # A chunk at a time, as the pipeline does
+        cleaned = []
+        for chunk in addon.clippings.chunked(matched, config['chunk_size']):
+            cleaned.extend(addon.vocab.cleanVocab_many([clipping.content for clipping, _ in chunk], words))
+        return cleaned
+    cleaned = measure(results, 'clean_vocab', cleanAll)
+
+    def buildNotes():
+        sentenceOrd = fieldNames.index(config['sentence_field'])
+        wordOrd = fieldNames.index(config['word_field'])
+        seenKeys = addon.importer.existingNoteKeys(mw.col.model, fieldNames)
+        for chunk in addon.clippings.chunked(list(zip(matched, cleaned)), config['chunk_size']):
+            pendingNotes = []
+            for (clipping, vocab), word in chunk:
+                noteFields = list(addon.notes.fields(clipping, fieldNames, vocab, config, words, word=word))
+                key = addon.notes.noteKeyOf(noteFields[sentenceOrd], noteFields[wordOrd])
+                if key in seenKeys:
+                    continue
+                seenKeys.add(key)
+                pendingNotes.append({'fields': noteFields, 'tags': [vocab.authors, vocab.title], 'vocab': vocab})
+            addon.importer.writeNotes(mw.col.model, pendingNotes)
+        return mw.col.notes
+    measure(results, 'notes', buildNotes)
+
+    resetState(addon, mw, paths)
+    result = measure(results, 'end_to_end', lambda: addon.importer.collectNotes(
+        paths['clippings'], mw.col.model, fieldNames, addon.importer.ImportProgress()),
+        items=lambda result: result.stats.clippings)
+
+    counts = {
+        'clippings': stats.clippings,
+        'highlights': stats.highlights,
+        'bad_clippings': len(stats.bad_clippings),
+        'matched': len(matched),
+        'notes': len(mw.col.notes),
+        'tiers': result.metrics.tiers,
+        'ambiguous': result.metrics.ambiguous,
+    }
+    return results, counts
+
+
+def benchmark(addon, mw, size, dataDir, workDir, seed, memory=True):
+    paths = generate.generate(size, os.path.join(dataDir, str(size)), seed)
+    # Point the add-on at the synthetic dictionary, compiled before anything is timed
+    compiled = os.path.join(workDir, 'jmdict_freqs.bin')
+    openWords = partial(addon.splitter.Words, paths['dictionary'], compiled)
+    addon.importer.MIRROR_PATH = os.path.join(workDir, 'vocab_mirror.db')
+    addon.importer.JOURNAL_PATH = os.path.join(workDir, 'import_journal.jsonl')
+    words = openWords()
+    addon.pipeline.Words = openWords
+    try:
+        timings, counts = runPipeline(addon, mw, paths, words, timed)
+        peaks = runPipeline(addon, mw, paths, words, traced)[0] if memory else {}
+    finally:
+        addon.pipeline.Words = addon.splitter.Words
+        words.close()
+    stages = {stage: dict(timings[stage], **peaks.get(stage, {'peak_bytes': None})) for stage in STAGES}
+    return {'size': size, 'counts': counts, 'stages': stages}
+
+
+def gitRevision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=stubs.ADDON_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def printResults(report, baseline=None):
+    previous = {}
+    if baseline:
+        previous = {run['size']: run['stages'] for run in baseline['runs']}
+    for run in report['runs']:
+        print(f"\n{run['size']} records: {run['counts']}")
+        for stage, result in run['stages'].items():
+            line = f"  {stage:<12}{result['seconds']:>10.3f}s"
+            if result['peak_bytes'] is not None:
+                line += f"{result['peak_bytes'] / 2**20:>10.1f} MiB"
+            before = previous.get(run['size'], {}).get(stage)
+            if before and result['seconds']:
+                line += f"{before['seconds'] / result['seconds']:>8.2f}x faster"
+            print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the import over synthetic Kindle data')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--output', help='results file; defaults to bench/results/<date>.json')
+    parser.add_argument('--compare', help='earlier results file to compare against')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-memory', dest='memory', action='store_false', help='skip the tracemalloc pass')
+    parser.add_argument('--keep', help='directory to generate data in and keep afterwards')
+    args = parser.parse_args()
+
+    root = args.keep or tempfile.mkdtemp(prefix='kindle-bench-')
+    dataDir = os.path.join(root, 'data')
+    workDir = os.path.join(root, 'work')
+    mw = stubs.install(workDir)
+    package = stubs.loadAddon()
+    addon = types.SimpleNamespace(**{name: stubs.loadModule(package, module) for name, module in ADDON_MODULES.items()})
+    addon.splitter._POOL = addon.splitter.PassThroughSplitter()
+    try:
+        runs = [benchmark(addon, mw, size, dataDir, workDir, args.seed, args.memory) for size in args.sizes]
+    finally:
+        if not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+
+    report = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'revision': gitRevision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'seed': args.seed,
+        'runs': runs,
+    }
+    output = args.output or os.path.join(stubs.ADDON_DIR, 'bench', 'results', datetime.now().strftime('%Y-%m-%d_%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+    printResults(report, baseline)
+    print(f'\nResults written to {output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+# Just enough of anki and aqt for importer.py to import and write notes
+# outside of Anki. Only the benchmark harness installs these.
+import importlib
+import json
+import os
+import re
+import sys
+import types
+from concurrent.futures import Future
+
+ADDON_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+
+class Note:
+    def __init__(self, col, model):
+        self.model = model
+        self.fields = [''] * len(model['flds'])
+        self.tags = []
+        self.id = None
+
+    def __contains__(self, name):
+        return name in self.model['flds']
+
+    def addTag(self, tag):
+        self.tags.append(tag)
+
+
+class CollectionDB:
+    def __init__(self, col):
+        self.col = col
+
+    def all(self, sql, *args):
+        if 'from notes' in sql:
+            # mid, the id to start after and the batch size
+            mid, after, limit = args
+            return [[note.id, '\x1f'.join(note.fields)] for note in self.col.notes if note.model['id'] == mid and note.id > after][:limit]
+        raise NotImplementedError(sql)
+
+    def list(self, sql, *args):
+        if 'from cards' in sql:
+            nids = {int(nid) for nid in re.findall(r'\d+', sql.split(' in ')[1])}
+            return [nid * 10 for nid in nids]
+        raise NotImplementedError(sql)
+
+
+class Collection:
+    def __init__(self, mediaDir, fieldNames):
+        self.notes = []
+        self.saves = 0
+        self.deckMoves = {}
+        self.db = CollectionDB(self)
+        self.media = types.SimpleNamespace(dir=lambda: mediaDir)
+        self.model = {'id': 1, 'name': 'Japanese Sentences', 'flds': list(fieldNames)}
+        self.models = types.SimpleNamespace(byName=lambda name: self.model, fieldNames=lambda model: model['flds'])
+        self._decks = {}
+        self.decks = types.SimpleNamespace(id=self._deckId, setDeck=self._setDeck)
+
+    def reset(self):
+        self.notes.clear()
+        self.deckMoves.clear()
+        self.saves = 0
+
+    def _deckId(self, name):
+        return self._decks.setdefault(name, len(self._decks) + 1)
+
+    def _setDeck(self, cids, deckId):
+        self.deckMoves[deckId] = self.deckMoves.get(deckId, 0) + len(cids)
+
+    def addNote(self, note):
+        self.notes.append(note)
+        note.id = len(self.notes)
+
+    def save(self):
+        self.saves += 1
+
+
+class AddonManager:
+    def __init__(self, config):
+        self.config = config
+
+    def getConfig(self, name):
+        return self.config
+
+    def writeConfig(self, name, config):
+        pass
+
+
+class TaskManager:
+    # Everything runs inline on the calling thread
+    def run_in_background(self, task, onDone):
+        future = Future()
+        try:
+            future.set_result(task())
+        except BaseException as e:
+            future.set_exception(e)
+        onDone(future)
+
+    def run_on_main(self, fn):
+        fn()
+
+
+class Progress:
+    def start(self, **kwargs):
+        pass
+
+    def update(self, **kwargs):
+        pass
+
+    def finish(self):
+        pass
+
+    def want_cancel(self):
+        return False
+
+
+def module(name, **attrs):
+    mod = types.ModuleType(name)
+    mod.__dict__.update(attrs)
+    sys.modules[name] = mod
+    return mod
+
+
+def install(workDir, **configOverrides):
+    # Returns the stub main window; the add-on's config.json is used with
+    # configOverrides on top
+    with open(os.path.join(ADDON_DIR, 'config.json'), encoding='utf-8') as f:
+        config = json.load(f)
+    config.update(configOverrides)
+    mediaDir = os.path.join(workDir, 'collection.media')
+    os.makedirs(mediaDir, exist_ok=True)
+    fieldNames = [config['sentence_field'], config['word_field'], config['source_field'], 'Notes']
+    mw = types.SimpleNamespace(
+        addonManager=AddonManager(config),
+        col=Collection(mediaDir, fieldNames),
+        progress=Progress(),
+        taskman=TaskManager(),
+        checkpoint=lambda name: None,
+    )
+
+    module('anki')
+    module('anki.notes', Note=Note)
+    module('anki.utils', isWin=sys.platform.startswith('win32'),
+           ids2str=lambda ids: '(%s)' % ','.join(str(i) for i in ids),
+           splitFields=lambda fields: fields.split('\x1f'))
+    module('aqt', mw=mw, gui_hooks=types.SimpleNamespace(profile_will_close=[]))
+    module('aqt.utils', getFile=lambda *args, **kwargs: None, showInfo=lambda text: None, showText=lambda text: None)
+    module('aqt.qt', QAction=object, QPushButton=object)
+    return mw
+
+
+def loadAddon(packageName='kindle_highlights'):
+    # The add-on folder is registered as a package without running its
+    # __init__.py, so core can be imported from it with no stubs at all and
+    # importer once install() has been called
+    package = types.ModuleType(packageName)
+    package.__path__ = [ADDON_DIR]
+    sys.modules[packageName] = package
+    return package
+
+
+def loadModule(package, name):
+    return importlib.import_module(package.__name__ + '.' + name)
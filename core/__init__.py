@@ -0,0 +1,3 @@
+# The import pipeline with nothing from Anki in it, so it can be run, profiled
+# and benchmarked on its own; see cli.py. The add-on's importer.py adapts it to
+# the collection and the GUI.
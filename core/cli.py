@@ -0,0 +1,107 @@
+# Runs an import without Anki and writes each matched highlight as a line of
+# JSON, for large backlogs and for profiling. From the add-on folder:
+#
+#   python -m core --kindle F:/ --output highlights.jsonl
+#   python -m cProfile -o import.prof -m core --kindle F:/ --all --no-mecab
+import argparse
+import json
+import os
+import sys
+
+from .clippings import ClippingStats
+from .lookups import noLog
+from .pipeline import HighlightPipeline
+from .runlog import RunLog, LEVELS
+from .splitter import ADDON_DIR, Words, PassThroughSplitter, shutdownSplitterPool
+
+MIRROR_PATH = os.path.join(ADDON_DIR, 'user_files', 'vocab_mirror.db')
+
+
+def loadConfig(path=None):
+    # config.json's defaults under the config Anki saved in meta.json, as the
+    # add-on sees it, then the file given on the command line over both
+    with open(os.path.join(ADDON_DIR, 'config.json'), encoding='utf-8') as f:
+        config = json.load(f)
+    for overrides in (os.path.join(ADDON_DIR, 'meta.json'), path):
+        if overrides and os.path.exists(overrides):
+            with open(overrides, encoding='utf-8') as f:
+                data = json.load(f)
+            config.update(data.get('config', data) if overrides.endswith('meta.json') else data)
+    return config
+
+
+def record(note, fieldNames):
+    vocab, clipping = note['vocab'], note['clipping']
+    return {
+        'clipping': clipping._asdict(),
+        'vocab': vocab._asdict(),
+        'fields': dict(zip(fieldNames, note['fields'])),
+        'tags': note['tags'],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m core', description='Match Kindle highlights to their Vocab Builder lookups without Anki')
+    parser.add_argument('--config', help="JSON file of config.json keys to use")
+    parser.add_argument('--kindle', help="the Kindle's root folder; defaults to the config's path")
+    parser.add_argument('--clippings', help="My Clippings.txt to read; defaults to the one on the Kindle")
+    parser.add_argument('--mirror', default=MIRROR_PATH, help='local copy of vocab.db to sync and match from')
+    parser.add_argument('--dictionary', help='jmdict_freqs.txt to deinflect against')
+    parser.add_argument('--all', action='store_true', help='ignore last_added and read every highlight')
+    parser.add_argument('--no-mecab', action='store_true', help="leave words the dictionary can't place as they are")
+    parser.add_argument('--output', help='file to write matched highlights to; defaults to stdout')
+    parser.add_argument('--report', help='file to write per-stage timings and counts to, as JSON')
+    parser.add_argument('--log', help='file to log to, as JSON lines')
+    parser.add_argument('--log-level', default='info', choices=LEVELS)
+    parser.add_argument('--verbose', action='store_true', help='log to stderr')
+    args = parser.parse_args(argv)
+
+    config = loadConfig(args.config)
+    if args.kindle:
+        config['path'] = args.kindle
+    if args.all:
+        config['last_added'] = None
+    # Nothing is written back, so a checkpoint would only skip highlights
+    config['clippings_checkpoint'] = None
+    clippingsPath = args.clippings or os.path.join(config['path'], 'documents', 'My Clippings.txt')
+    if args.log:
+        log = RunLog(args.log, args.log_level)
+    elif args.verbose:
+        log = lambda line: print(line, file=sys.stderr)
+    else:
+        log = noLog
+    words = Words(args.dictionary, os.path.splitext(args.dictionary)[0] + '.bin') if args.dictionary else Words()
+    pipeline = HighlightPipeline(config, args.mirror, log, words, PassThroughSplitter() if args.no_mecab else None)
+    fieldNames = [config['sentence_field'], config['word_field'], config['source_field']]
+
+    stats = ClippingStats()
+    try:
+        clippings = pipeline.clippings(clippingsPath, stats)
+    except FileNotFoundError:
+        parser.exit(1, f'No clippings at {clippingsPath}\n')
+    pipeline.sync()
+
+    out = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    matched = unmatched = duplicates = 0
+    try:
+        for result in pipeline.chunks(clippings, fieldNames, set()):
+            for note in result.notes:
+                out.write(json.dumps(record(note, fieldNames), ensure_ascii=False) + '\n')
+            for clipping in result.no_vocab:
+                log(f'no lookup found for: {clipping}')
+            matched += len(result.notes)
+            unmatched += len(result.no_vocab)
+            duplicates += result.duplicates
+    finally:
+        words.close()
+        shutdownSplitterPool()
+        if args.log:
+            log.close()
+        if out is not sys.stdout:
+            out.close()
+
+    print(f'{stats.clippings} clippings, {stats.to_add} new highlights: {matched} matched, '
+          f'{unmatched} unmatched, {duplicates} duplicates, {len(stats.bad_clippings)} unparseable', file=sys.stderr)
+    print(pipeline.metrics.summary(), file=sys.stderr)
+    if args.report:
+        pipeline.metrics.write(args.report)
@@ -0,0 +1,84 @@
+import re
+from datetime import datetime
+from functools import lru_cache
+
+# Parses the "added" date of a clipping without strptime, so it doesn't depend
+# on the process locale. Kindles write it in their UI language, e.g.
+#   2021年2月3日水曜日 8:50:57
+#   Wednesday, February 3, 2021 8:50:57 AM
+#   mercredi 3 février 2021 08:50:57
+#   Mittwoch, 3. Februar 2021 08:50:57
+#   miércoles, 3 de febrero de 2021 8:50:57
+#   2021年2月3日星期三 下午8:50:57
+
+CJK_DATE = re.compile(r'(\d{4})\s*年\s*(\d{1,2})\s*月\s*(\d{1,2})\s*日')
+NUMERIC_DATE = re.compile(r'(\d{4})[-/.](\d{1,2})[-/.](\d{1,2})')
+TIME = re.compile(r'(\d{1,2}):(\d{2})(?::(\d{2}))?')
+WORD = re.compile(r'[^\W\d_]+|\d+')
+
+PM_MARKERS = ('pm', 'p.m.', '午後', '下午')
+AM_MARKERS = ('am', 'a.m.', '午前', '上午')
+
+MONTH_NAMES = [
+    # en, fr, de, es, it, pt, nl
+    ('january', 'jan', 'janvier', 'janv', 'januar', 'jänner', 'enero', 'ene', 'gennaio', 'gen', 'janeiro', 'januari'),
+    ('february', 'feb', 'février', 'févr', 'februar', 'febrero', 'febbraio', 'fevereiro', 'fev', 'februari'),
+    ('march', 'mar', 'mars', 'märz', 'marzo', 'março', 'maart', 'mrt'),
+    ('april', 'apr', 'avril', 'avr', 'abril', 'abr', 'aprile'),
+    ('may', 'mai', 'mayo', 'maggio', 'mag', 'maio', 'mei'),
+    ('june', 'jun', 'juin', 'juni', 'junio', 'giugno', 'giu', 'junho'),
+    ('july', 'jul', 'juillet', 'juil', 'juli', 'julio', 'luglio', 'lug', 'julho'),
+    ('august', 'aug', 'août', 'agosto', 'ago', 'augustus'),
+    ('september', 'sep', 'sept', 'septembre', 'septiembre', 'settembre', 'set', 'setembro'),
+    ('october', 'oct', 'octobre', 'oktober', 'okt', 'octubre', 'ottobre', 'ott', 'outubro', 'out'),
+    ('november', 'nov', 'novembre', 'noviembre', 'novembro'),
+    ('december', 'dec', 'décembre', 'déc', 'dezember', 'dez', 'diciembre', 'dic', 'dicembre', 'dezembro'),
+]
+MONTHS = {name: month for month, names in enumerate(MONTH_NAMES, 1) for name in names}
+
+
+def parseDate(text):
+    match = CJK_DATE.search(text) or NUMERIC_DATE.search(text)
+    if match:
+        return tuple(int(part) for part in match.groups())
+    year = month = day = None
+    for word in WORD.findall(text):
+        if word.isdigit():
+            if len(word) == 4:
+                year = int(word)
+            elif day is None:
+                day = int(word)
+        elif month is None:
+            month = MONTHS.get(word.lower())
+    if None in (year, month, day):
+        return None
+    return year, month, day
+
+
+@lru_cache(maxsize=4096)
+def parse_clipping_added(clipping_added):
+    # Returns a naive local datetime, or None if the text isn't a date we know
+    if not clipping_added:
+        return None
+    time = TIME.search(clipping_added)
+    if not time:
+        return None
+    date = parseDate(clipping_added[:time.start()])
+    if not date:
+        return None
+    hour, minute, second = int(time.group(1)), int(time.group(2)), int(time.group(3) or 0)
+    # AM/PM follows the time in English, 午前/午後 and 上午/下午 come right before it
+    marker = (clipping_added[max(0, time.start() - 2):time.start()] + clipping_added[time.end():]).lower()
+    if hour < 12 and any(pm in marker for pm in PM_MARKERS):
+        hour += 12
+    elif hour == 12 and any(am in marker for am in AM_MARKERS):
+        hour = 0
+    try:
+        return datetime(*date, hour, minute, second)
+    except ValueError:
+        return None
+
+
+def clipping_timestamp(clipping_added):
+    added = parse_clipping_added(clipping_added)
+    return added.timestamp() if added else None
@@ -0,0 +1,381 @@
+import hashlib
+import mmap
+import os
+import re
+from collections import namedtuple
+from contextlib import closing
+from datetime import datetime
+from html import unescape
+
+from .clippingdates import clipping_timestamp
+
+# timestamp is the epoch seconds of added, parsed once when the clipping is read
+Clipping = namedtuple('Clipping', ('kind', 'document', 'page', 'location', 'added', 'content', 'timestamp'), defaults=(None,))
+
+
+class ClippingStats:
+    # Tally of what the clipping stream has seen, filled in as it is consumed
+    def __init__(self):
+        self.clippings = 0
+        self.highlights = 0
+        self.to_add = 0
+        self.bad_clippings = []
+        self.checkpoint = None
+        self.last_added = None
+
+
+def getClippings(path, stats, lastAdded=None, checkpoint=None):
+    # Opens the file straight away so a missing one fails here, then returns a
+    # generator of the clippings to add that reads only as far as it is consumed.
+    # lastAdded and checkpoint are the last_added and clippings_checkpoint config values
+    lower_path = path.lower()
+    if lower_path.endswith('txt'):
+        file = open(path, 'rb')
+        stats.checkpoint = resumeClippings(file, checkpoint, lastAdded)
+        clippings = parse_text_clippings(file, stats)
+    elif lower_path.endswith('html'):
+        file = open(path, 'rb')
+        stats.checkpoint = resumeClippings(file, checkpoint, lastAdded)
+        clippings = parse_html_clippings(file, stats)
+    else:
+        raise RuntimeError(f'Unknown extension in path: {path!r}')
+    return clippingsToAdd(file, clippings, stats, parseLastAdded(lastAdded))
+
+
+def clippingsToAdd(file, clippings, stats, last_added=None):
+    # Closing the stream early closes the file and lets go of the parser's mapping
+    with file, closing(clippings):
+        for clipping in clippings:
+            stats.clippings += 1
+            if not is_highlight(clipping):
+                continue
+            stats.highlights += 1
+            if not is_after_last_added(clipping, last_added):
+                continue
+            stats.to_add += 1
+            stats.last_added = clipping.added
+            yield clipping
+
+
+def chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def resumeClippings(file, checkpoint, lastAdded):
+    # Seeks past everything parsed last time if the record the checkpoint ended on
+    # is still in place; otherwise the file was truncated or rewritten, so start over
+    if not checkpoint or checkpoint.get('last_added') != lastAdded:
+        return None
+    start = checkpoint['offset'] - checkpoint['length']
+    if start >= 0:
+        file.seek(start)
+        if clippingFingerprint(file.read(checkpoint['length'])) == checkpoint['fingerprint']:
+            return checkpoint
+    file.seek(0)
+    return None
+
+
+def clippingFingerprint(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+def parseLastAdded(lastAdded):
+    return datetime.strptime(lastAdded, '%Y-%m-%dT%H:%M:%S') if lastAdded else None
+
+
+def is_after_last_added(clipping, last_added):
+    # Clippings are appended in the order they were made, so this is checked as
+    # the file streams by rather than by searching back from the end of it
+    if not last_added or clipping.timestamp is None:
+        return True
+    return clipping.timestamp > last_added.timestamp()
+
+
+# It could be bookmarks too - which would break
+def is_highlight(clipping):
+    return 'ハイライト' in clipping.kind.lower()
+
+
+def parse_text_clippings(file, stats):
+    # file is opened in binary so the byte offset of each record is known;
+    # parsing starts wherever the file is positioned, i.e. at stats.checkpoint['offset'].
+    # Clippings are yielded as they are read; bad ones and the checkpoint go on stats.
+    # The file is mapped rather than read, records are found by searching for the
+    # separator and only the slices that make up a clipping are decoded, so every
+    # byte is looked at a fixed number of times however a record is mangled
+    start = file.tell()
+    size = os.fstat(file.fileno()).st_size
+    if start >= size:
+        return
+    with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        searchFrom = start
+        while True:
+            separator = data.find(SEPARATOR, searchFrom)
+            if separator < 0:
+                break
+            end = separator + len(SEPARATOR)
+            if data[end:end + 1] == b'\n':
+                end += 1
+            elif data[end:end + 2] == b'\r\n':
+                end += 2
+            else:
+                end = -1
+            # The separator is a line of its own; one in the middle of a line is content
+            if end < 0 or (separator > start and data[separator - 1] != NEWLINE):
+                searchFrom = separator + 1
+                continue
+
+            record = data[start:separator]
+            stats.checkpoint = {'offset': end, 'length': end - start, 'fingerprint': clippingFingerprint(data[start:end])}
+            start = searchFrom = end
+
+            clipping = parse_text_clipping(record)
+            if clipping:
+                # get around blank highlights; seems to be a kindle bug; Also don't want to bug the user with calling it a bad_clipping
+                if clipping.content:
+                    yield clipping
+            elif BOOKMARK not in record:
+                stats.bad_clippings.append(record_text(record))
+
+        if start < size:
+            stats.bad_clippings.append(record_text(data[start:size]))
+
+
+def parse_text_clipping(record):
+    # record is the bytes of one clipping up to its separator:
+    #   document
+    #   - [page]ページ|位置No. [location]の[kind |]作成日: added
+    #   (blank)
+    #   content
+    # Each line is cut out by its newline and the header is taken apart with
+    # find(), so a mangled record fails after one look rather than backtracking
+    lines = []
+    position = 0
+    for _ in range(3):
+        newline = record.find(b'\n', position)
+        if newline < 0:
+            return None
+        lines.append(record[position:newline - 1 if record[newline - 1:newline] == b'\r' else newline])
+        position = newline + 1
+    document, header, blank = lines
+    content = record[position:]
+    if content.endswith(b'\r\n'):
+        content = content[:-2]
+    elif content.endswith(b'\n'):
+        content = content[:-1]
+    if blank or b'\n' in content or not header.startswith(b'- '):
+        return None
+
+    location = header.find(LOCATION_MARK, 2)
+    if location < 0:
+        return None
+    page = None
+    if location > 2:
+        page = location - len(PAGE_MARK)
+        if page < 2 or header[page:location] != PAGE_MARK:
+            return None
+        page = header[2:page]
+    location += len(LOCATION_MARK)
+    added = header.find(ADDED_MARK, location)
+    if added < 0:
+        return None
+    of = header.find(OF_MARK, location, added)
+    if of < 0:
+        return None
+    kind = None
+    if of + len(OF_MARK) < added:
+        if header[added - len(KIND_END):added] != KIND_END:
+            return None
+        kind = header[of + len(OF_MARK):added - len(KIND_END)]
+
+    try:
+        added = header[added + len(ADDED_MARK):].decode('utf-8')
+        return Clipping(
+            kind=kind.decode('utf-8') if kind is not None else None,
+            document=document.decode('utf-8-sig'),
+            page=page.decode('utf-8') if page is not None else None,
+            location=header[location:of].decode('utf-8'),
+            added=added,
+            content=content.decode('utf-8'),
+            timestamp=clipping_timestamp(added),
+        )
+    except UnicodeDecodeError:
+        return None
+
+
+def record_text(record):
+    return record.decode('utf-8', errors='replace').replace('\r\n', '\n')
+
+
+SEPARATOR = b'=========='
+NEWLINE = ord('\n')
+BOOKMARK = 'ブックマーク'.encode('utf-8')
+PAGE_MARK = 'ページ|'.encode('utf-8')
+LOCATION_MARK = '位置No. '.encode('utf-8')
+OF_MARK = 'の'.encode('utf-8')
+KIND_END = b' |'
+ADDED_MARK = '作成日: '.encode('utf-8')
+
+
+# Kindle notebook exports (the Kindle apps' "Export notebook", and Android) are
+# one HTML file per book: bookTitle and authors divs, then for each annotation a
+# noteHeading div such as
+#   ハイライト(<span class="highlight_yellow">黄</span>) - ページ12 · 位置No. 123
+# followed by a noteText div. There are no dates, so the clippings have none.
+NOTEBOOK_FIELDS = ('bookTitle', 'authors', 'noteHeading', 'noteText')
+HEADING_KIND = re.compile(r'\s*([^(\-]*[^(\-\s])')
+HEADING_PAGE = re.compile(r'(?:ページ|\bPage)\s*([^\s·]+)')
+HEADING_LOCATION = re.compile(r'(?:位置No\.|\bLocation)\s*([^\s·]+)')
+# A tag, or a comment, doctype or declaration to step over
+HTML_TAG = re.compile(r'<(/?)([A-Za-z][^\s/>]*)([^>]*)>|<!--.*?-->|<[!?][^>]*>', re.S)
+HTML_CLASS = re.compile(r'''class\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+))''', re.I)
+READ_SIZE = 1 << 16
+
+
+class NotebookParser:
+    # Collects clippings from the tag and text events of the HTML fed to it,
+    # keeping nothing but the div being read; only whole tags may be fed.
+    # Finished clippings and the text of notes that can't be read pile up in
+    # clippings and bad_clippings for the caller to take.
+    def __init__(self, title=None, authors=None):
+        self.title = title
+        self.authors = authors
+        self.heading = None
+        self.clippings = []
+        self.bad_clippings = []
+        self._field = None
+        self._depth = 0
+        self._text = []
+
+    def feed(self, html):
+        position = 0
+        for tag in HTML_TAG.finditer(html):
+            if self._field and tag.start() > position:
+                self.handle_data(html[position:tag.start()])
+            position = tag.end()
+            if not tag.group(2):
+                continue
+            if tag.group(1):
+                self.handle_endtag(tag.group(2).lower())
+            else:
+                self.handle_starttag(tag.group(2).lower(), tag.group(3))
+        if self._field and position < len(html):
+            self.handle_data(html[position:])
+
+    def handle_starttag(self, tag, attrs):
+        if self._field:
+            if tag == 'div':
+                self._depth += 1
+            elif tag == 'br':
+                self._text.append('\n')
+            return
+        if tag == 'div':
+            match = HTML_CLASS.search(attrs)
+            classes = ''.join(match.groups('')).split() if match else ()
+            self._field = next((name for name in classes if name in NOTEBOOK_FIELDS), None)
+            self._depth = 0
+            self._text.clear()
+
+    def handle_data(self, data):
+        if self._field:
+            self._text.append(data)
+
+    def handle_endtag(self, tag):
+        if not self._field or tag != 'div':
+            return
+        if self._depth:
+            self._depth -= 1
+            return
+        field, self._field = self._field, None
+        text = unescape(''.join(self._text)).strip()
+        if field == 'bookTitle':
+            self.title = text
+        elif field == 'authors':
+            self.authors = text
+        elif field == 'noteHeading':
+            self.heading = ' '.join(text.split())
+        else:
+            clipping = self.clipping(text)
+            if clipping:
+                self.clippings.append(clipping)
+            else:
+                self.bad_clippings.append(f'{self.heading or ""}\n{text}')
+            self.heading = None
+
+    def document(self):
+        # Named like the first line of a My Clippings.txt record, "title (authors)"
+        return f'{self.title} ({self.authors})' if self.authors else self.title
+
+    def clipping(self, content):
+        kind = HEADING_KIND.match(self.heading or '')
+        if not kind or not content:
+            return None
+        kind = kind.group(1)
+        # is_highlight looks for the Japanese name
+        if kind.lower().startswith('highlight'):
+            kind = 'ハイライト'
+        page = HEADING_PAGE.search(self.heading)
+        location = HEADING_LOCATION.search(self.heading)
+        return Clipping(
+            kind=kind,
+            document=self.document(),
+            page=page.group(1) if page else None,
+            location=location.group(1) if location else None,
+            added=None,
+            content=content,
+        )
+
+
+def parse_html_clippings(file, stats):
+    # Streams a notebook export read in binary, like parse_text_clippings:
+    # starting wherever the file is positioned, each clipping is yielded as soon
+    # as its closing </div> has been read, and stats.checkpoint covers the bytes
+    # since the previous one. The checkpoint also keeps the book, which is only
+    # named at the top of the file.
+    checkpoint = stats.checkpoint or {}
+    offset = checkpoint.get('offset', 0)
+    parser = NotebookParser(checkpoint.get('title'), checkpoint.get('authors'))
+    pending = bytearray()
+    record = []
+    encoding = 'utf-8' if offset else 'utf-8-sig'
+    while True:
+        data = file.read(READ_SIZE)
+        # only the tail of what was already searched can hold the start of a </div>
+        searchFrom = max(0, len(pending) - len(b'</div>') + 1)
+        pending += data
+        start = 0
+        while True:
+            # Fed up to each </div> so a clipping's end is known to the byte
+            end = pending.find(b'</div>', max(start, searchFrom))
+            if end < 0:
+                break
+            end += len(b'</div>')
+            segment = bytes(pending[start:end])
+            start = end
+            offset += len(segment)
+            record.append(segment)
+            parser.feed(segment.decode(encoding, errors='replace'))
+            encoding = 'utf-8'
+            if not (parser.clippings or parser.bad_clippings):
+                continue
+
+            recordData = b''.join(record)
+            record.clear()
+            stats.checkpoint = {
+                'offset': offset, 'length': len(recordData), 'fingerprint': clippingFingerprint(recordData),
+                'title': parser.title, 'authors': parser.authors,
+            }
+            stats.bad_clippings.extend(parser.bad_clippings)
+            parser.bad_clippings.clear()
+            yield from parser.clippings
+            parser.clippings.clear()
+        del pending[:start]
+        if not data:
+            break
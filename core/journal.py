@@ -0,0 +1,44 @@
+import hashlib
+import json
+import os
+
+
+def clippingKey(clipping):
+    return hashlib.sha1('\x1f'.join(str(field) for field in clipping).encode('utf-8')).hexdigest()
+
+
+class ImportJournal:
+    # Append-only record of the clippings whose notes are already in the
+    # collection. One JSON line is written and synced per committed chunk, so an
+    # import that dies partway resumes after the last chunk that made it.
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        committed = set()
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        committed.update(json.loads(line)['clippings'])
+                    except (ValueError, KeyError):
+                        # a chunk cut off mid-write never committed its journal entry
+                        continue
+        except FileNotFoundError:
+            pass
+        return committed
+
+    def append(self, keys):
+        if not keys:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({'clippings': list(keys)}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
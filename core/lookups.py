@@ -0,0 +1,166 @@
+import os
+from collections import namedtuple
+from datetime import datetime
+
+from .matcher import findCandidates, findCandidatesInWindow
+from .mirror import openMirror, syncMirror, queryPlan
+
+Vocab = namedtuple('Vocab', ('stem', 'word', 'usage', 'timestamp', 'title', 'authors'))
+
+VOCAB_LOOKUPS_SQL = '''
+    select WORDS.stem, WORDS.word, LOOKUPS.usage, LOOKUPS.timestamp, BOOK_INFO.title, BOOK_INFO.authors
+    from {windows}LOOKUPS left join WORDS
+    on WORDS.id = LOOKUPS.word_key
+    left join BOOK_INFO
+    on BOOK_INFO.id = LOOKUPS.book_key
+    WHERE LOOKUPS.timestamp >= ?
+    {windowFilter}
+	ORDER BY LOOKUPS.timestamp DESC;
+    '''
+
+# Each window is a range on the timestamp index; they don't overlap, so no
+# lookup comes back twice
+WITHIN_WINDOWS_SQL = 'AND LOOKUPS.timestamp BETWEEN LOOKUP_WINDOWS.start AND LOOKUP_WINDOWS.end'
+
+
+def noLog(line):
+    pass
+
+
+def getTimestamp(lastAdded):
+    longAgo = 1362301382
+    if lastAdded:
+        # time since last round, minus a day
+        ts = datetime.strptime(lastAdded, '%Y-%m-%dT%H:%M:%S').timestamp() - 86400
+    else:
+        ts = longAgo
+    return ts
+
+
+def getLookupsSince(lastAdded):
+    # Lookups are compared at whole-second resolution, so anything in or after the
+    # second following getTimestamp() is newer. A plain range on the raw
+    # millisecond column lets SQLite use the timestamp index instead of scanning.
+    return (int(getTimestamp(lastAdded)) + 1) * 1000
+
+
+def syncVocabLookups(mirrorPath, kindlePath, log=noLog):
+    conn = openMirror(mirrorPath)
+    try:
+        path = os.path.join(kindlePath, 'system', 'vocabulary', 'vocab.db')
+        if syncMirror(conn, path, log) is None:
+            log(f'Kindle vocab.db not found at {path}, using the local mirror only')
+    finally:
+        conn.close()
+
+
+def iterVocabLookups(mirrorPath, since, batchSize=1000, explain=False, windows=None, log=noLog):
+    # since is in epoch milliseconds, from getLookupsSince; windows optionally
+    # narrows it to lookups inside one of those (start, end) ranges, in epoch
+    # seconds and not overlapping. Which usages contain a highlight is left to
+    # HighlightMatcher, which tests every highlight in one pass over a usage.
+    conn = openMirror(mirrorPath)
+    # sqlite3.OperationalError: Could not decode to UTF-8 column 'usage' with text; Happens with blob data?
+    conn.text_factory = lambda b: b.decode(errors = 'ignore')
+    params = (since,)
+    # The connection is this query's own, so the table goes with it
+    if windows is None:
+        windowsTable = windowFilter = ''
+    else:
+        conn.execute('CREATE TEMP TABLE LOOKUP_WINDOWS (start INTEGER, end INTEGER)')
+        conn.executemany('INSERT INTO temp.LOOKUP_WINDOWS (start, end) VALUES (?, ?)', ((int(start * 1000), int(end * 1000)) for start, end in windows))
+        # CROSS JOIN keeps the windows on the outside, so each is one index range
+        windowsTable = 'temp.LOOKUP_WINDOWS CROSS JOIN '
+        windowFilter = WITHIN_WINDOWS_SQL
+    sql = VOCAB_LOOKUPS_SQL.format(windows=windowsTable, windowFilter=windowFilter)
+    if explain:
+        for detail in queryPlan(conn, sql, params):
+            log(f'vocab lookups plan: {detail}')
+    cur = conn.execute(sql, params)
+    try:
+        while True:
+            rows = cur.fetchmany(batchSize)
+            if not rows:
+                break
+            for row in rows:
+                yield Vocab(*row)
+    finally:
+        conn.close()
+
+
+def getTimestampDistance(clipping, vocab):
+    if clipping.timestamp is None:
+        # nothing to measure against; the newest usage wins
+        return 0
+    return abs(clipping.timestamp - vocab.timestamp/1000)
+
+
+def lookupWindows(timestamps, window):
+    # The ranges within window seconds of any of timestamps, overlaps merged
+    windows = []
+    for timestamp in sorted(timestamps):
+        if windows and timestamp - window <= windows[-1][1]:
+            windows[-1][1] = timestamp + window
+        else:
+            windows.append([timestamp - window, timestamp + window])
+    return windows
+
+
+def matchClippings(clippings, books, lookups, window, explain=False):
+    # Each book's highlights are matched against that book's lookups within
+    # window seconds of them, as a merge of the two time-ordered streams;
+    # highlights whose book isn't in BOOK_INFO, or was only guessed from the
+    # start of its name, are matched against every book.
+    # Anything closer than the window always beats anything outside it, so only
+    # highlights left without a candidate need the full history of lookups:
+    # those are for matchLeftovers, once the whole run has been through here.
+    # lookups is iterVocabLookups with the mirror and since filled in.
+    #
+    # The lookups around every highlight are read in one query, whatever the
+    # number of books, and split up by book here.
+    timestamps = [clipping.timestamp for clipping in clippings if clipping.timestamp is not None]
+    if not timestamps:
+        return [[] for _ in clippings]
+    windowed = list(lookups(explain=explain, windows=lookupWindows(timestamps, window)))
+    byBook = {}
+    titles = {}
+    for vocab in windowed:
+        if vocab.title not in titles:
+            titles[vocab.title] = books.ofTitle(vocab.title)
+        byBook.setdefault(titles[vocab.title], []).append(vocab)
+
+    groups = {}
+    for i, clipping in enumerate(clippings):
+        book, guessed = books.resolve(clipping.document)
+        groups.setdefault(None if guessed else book, []).append(i)
+    candidates = [None] * len(clippings)
+    for book, indices in groups.items():
+        vocabs = windowed if book is None else byBook.get(book, [])
+        found = findCandidatesInWindow([clippings[i] for i in indices], vocabs, getTimestampDistance, window)
+        for i, clippingCandidates in zip(indices, found):
+            candidates[i] = clippingCandidates
+    return candidates
+
+
+def matchLeftovers(clippings, books, lookups):
+    # The highlights matchClippings found nothing for, from every chunk of the
+    # run, against the full history of lookups in a single streamed pass, so
+    # each lookup is read once however many chunks had leftovers. A highlight
+    # takes lookups from its own book if there are any, and otherwise from any
+    # book: the lookup may have been made in a copy BOOK_INFO doesn't list
+    # under that title. One whose book was only guessed takes them from any.
+    candidates = findCandidates(clippings, lookups(), getTimestampDistance)
+    for i, clipping in enumerate(clippings):
+        book, guessed = books.resolve(clipping.document)
+        if book is not None and not guessed:
+            inBook = [(vocab, distance) for vocab, distance in candidates[i] if books.ofTitle(vocab.title) == book]
+            candidates[i] = inBook or candidates[i]
+    return candidates
+
+
+def closestVocab(candidates):
+    # first of the closest in time, as vocabs are newest first
+    if not candidates:
+        return None
+    distances = [distance for _, distance in candidates]
+    return candidates[distances.index(min(distances))][0]
@@ -0,0 +1,116 @@
+from bisect import bisect_left
+
+
+class HighlightMatcher:
+    # Aho-Corasick automaton over the highlighted strings. search() finds every
+    # highlight contained in a text in a single pass over that text, instead of
+    # running `highlight in text` once per highlight.
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+        self._empty = []
+        for index, pattern in enumerate(self.patterns):
+            if not pattern:
+                # '' is in every string
+                self._empty.append(index)
+                continue
+            node = 0
+            for char in pattern:
+                nxt = self._goto[node].get(char)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                    self._goto[node][char] = nxt
+                node = nxt
+            self._out[node].append(index)
+        self._link()
+
+    def _link(self):
+        goto, fail, out = self._goto, self._fail, self._out
+        queue = list(goto[0].values())
+        for node in queue:
+            for char, child in goto[node].items():
+                queue.append(child)
+                state = fail[node]
+                while state and char not in goto[state]:
+                    state = fail[state]
+                target = goto[state].get(char, 0)
+                fail[child] = target if target != child else 0
+                # Patterns that end at the fallback state also end here
+                out[child] = out[child] + out[fail[child]]
+
+    def search(self, text):
+        goto, fail, out = self._goto, self._fail, self._out
+        found = set(self._empty)
+        node = 0
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if out[node]:
+                found.update(out[node])
+        return found
+
+
+def findCandidates(clippings, vocabs, distance):
+    # For each clipping, every vocab whose usage contains the highlight, in
+    # vocabs order, paired with distance(clipping, vocab). Each usage is
+    # scanned once no matter how many clippings are pending.
+    contents = {}
+    for i, clipping in enumerate(clippings):
+        contents.setdefault(clipping.content, []).append(i)
+    matcher = HighlightMatcher(contents)
+
+    candidates = [[] for _ in clippings]
+    usageMatches = {}
+    for vocab in vocabs:
+        usage = vocab.usage
+        if usage not in usageMatches:
+            usageMatches[usage] = [matcher.patterns[p] for p in sorted(matcher.search(usage or ''))]
+        for content in usageMatches[usage]:
+            for i in contents[content]:
+                candidates[i].append((vocab, distance(clippings[i], vocab)))
+    return candidates
+
+
+def findCandidatesInWindow(clippings, vocabs, distance, window):
+    # Like findCandidates, but a vocab is only paired with clippings made within
+    # `window` seconds of its lookup. vocabs must be newest first; clippings with
+    # no timestamp are left without candidates. Clippings are walked with two
+    # pointers as the lookups stream past, so each pair of streams is merged in a
+    # single pass instead of every usage being checked against every highlight.
+    timed = sorted((clipping.timestamp, i) for i, clipping in enumerate(clippings) if clipping.timestamp is not None)
+    times = [t for t, _ in timed]
+    order = [i for _, i in timed]
+
+    # positions in `timed` of each distinct highlight, ascending
+    contents = {}
+    for position, i in enumerate(order):
+        contents.setdefault(clippings[i].content, []).append(position)
+    matcher = HighlightMatcher(contents)
+
+    candidates = [[] for _ in clippings]
+    usageMatches = {}
+    lo = hi = len(times)
+    for vocab in vocabs:
+        t = vocab.timestamp / 1000
+        # window for this lookup is times[lo:hi]; both ends only move down
+        while hi > 0 and times[hi - 1] > t + window:
+            hi -= 1
+        while lo > 0 and times[lo - 1] >= t - window:
+            lo -= 1
+        if lo >= hi:
+            continue
+        usage = vocab.usage
+        if usage not in usageMatches:
+            usageMatches[usage] = [matcher.patterns[p] for p in sorted(matcher.search(usage or ''))]
+        for content in usageMatches[usage]:
+            positions = contents[content]
+            for position in positions[bisect_left(positions, lo):bisect_left(positions, hi)]:
+                i = order[position]
+                candidates[i].append((vocab, distance(clippings[i], vocab)))
+    return candidates
@@ -0,0 +1,63 @@
+import json
+import time
+from contextlib import contextmanager
+
+# Which step of deinflectVocab settled on the word
+TIER_DICTIONARY = 'dictionary'
+TIER_DECONJUGATION = 'deconjugation'
+TIER_MECAB = 'mecab'
+TIERS = (TIER_DICTIONARY, TIER_DECONJUGATION, TIER_MECAB)
+
+
+class ImportMetrics:
+    # Wall time and item count per pipeline stage, which deinflection tier
+    # resolved each word, and how many clippings matched no lookup or several.
+    # Stages can nest; a stage's time excludes the stages run inside it, so the
+    # times add up to the whole import. Used from one thread at a time.
+    def __init__(self):
+        self.stages = {}
+        self.tiers = dict.fromkeys(TIERS, 0)
+        self.unmatched = 0
+        self.ambiguous = 0
+        self._open = []
+
+    @contextmanager
+    def stage(self, name, items=0):
+        start = time.perf_counter()
+        self._open.append(0.0)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            nested = self._open.pop()
+            if self._open:
+                self._open[-1] += elapsed
+            self.count(name, items, elapsed - nested)
+
+    def count(self, name, items, seconds=0.0):
+        stage = self.stages.setdefault(name, {'seconds': 0.0, 'items': 0})
+        stage['seconds'] += seconds
+        stage['items'] += items
+
+    def resolvedBy(self, tier):
+        self.tiers[tier] += 1
+
+    def report(self):
+        return {
+            'stages': self.stages,
+            'tiers': self.tiers,
+            'unmatched': self.unmatched,
+            'ambiguous': self.ambiguous,
+            'seconds': sum(stage['seconds'] for stage in self.stages.values()),
+        }
+
+    def summary(self):
+        stages = ', '.join(
+            f"{name} {stage['seconds']:.2f}s" + (f" ({stage['items']})" if stage['items'] else '')
+            for name, stage in self.stages.items())
+        tiers = ', '.join(f'{self.tiers[tier]} {tier}' for tier in TIERS)
+        return f'Time: {stages}.\nWords found by: {tiers}.\n{self.unmatched} unmatched, {self.ambiguous} matched more than one lookup.'
+
+    def write(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.report(), f, indent=2)
@@ -0,0 +1,152 @@
+import os
+import re
+import sqlite3
+import unicodedata
+from pathlib import Path
+
+# Local copy of the Kindle's vocab.db tables the importer reads. Only rows newer
+# than what is already mirrored are copied over from the device, and matching
+# reads from here, so it still works with the Kindle unplugged. New lookups are
+# appended to the device's LOOKUPS, so SYNC_WATERMARK keeps the rowid and id of
+# the last one copied, and the next sync starts after it.
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS WORDS (id TEXT PRIMARY KEY NOT NULL, word TEXT, stem TEXT, lang TEXT, timestamp INTEGER DEFAULT 0);
+CREATE TABLE IF NOT EXISTS LOOKUPS (id TEXT PRIMARY KEY NOT NULL, word_key TEXT, book_key TEXT, usage TEXT, timestamp INTEGER DEFAULT 0);
+CREATE TABLE IF NOT EXISTS BOOK_INFO (id TEXT PRIMARY KEY NOT NULL, asin TEXT, guid TEXT, lang TEXT, title TEXT, authors TEXT);
+CREATE INDEX IF NOT EXISTS lookups_timestamp ON LOOKUPS (timestamp);
+CREATE INDEX IF NOT EXISTS lookups_book_key ON LOOKUPS (book_key, timestamp);
+CREATE TABLE IF NOT EXISTS SYNC_WATERMARK (lookups_rowid INTEGER NOT NULL, lookups_id TEXT NOT NULL);
+DROP TABLE IF EXISTS BOOK_ALIASES;
+'''
+
+
+def openMirror(mirrorPath):
+    os.makedirs(os.path.dirname(mirrorPath), exist_ok=True)
+    # uri=True so the Kindle database can be attached read-only by URI
+    conn = sqlite3.connect(Path(mirrorPath).resolve().as_uri(), uri=True)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def queryPlan(conn, sql, params=()):
+    return [row[-1] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params)]
+
+
+def hasIndex(conn, schema, table, column):
+    # True if some index on table starts with column, so a range on it can be searched
+    for index in conn.execute(f'PRAGMA {schema}.index_list({table})').fetchall():
+        columns = conn.execute(f'PRAGMA {schema}.index_info("{index[1]}")').fetchall()
+        if columns and columns[0][2] == column:
+            return True
+    return False
+
+
+def lookupsWatermark(conn):
+    # The device rowid the mirror has every lookup up to, or None if there's
+    # none yet or the device's LOOKUPS no longer has the same lookup there,
+    # e.g. vocab.db was reset or words were deleted on the Kindle
+    row = conn.execute('SELECT lookups_rowid, lookups_id FROM SYNC_WATERMARK').fetchone()
+    if row is None:
+        return None
+    rowid, lookupId = row
+    found = conn.execute('SELECT id FROM kindle.LOOKUPS WHERE rowid = ?', (rowid,)).fetchone()
+    return rowid if found and found[0] == lookupId else None
+
+
+def syncMirror(conn, kindlePath, log=None):
+    # Returns how many lookups were copied, or None when the Kindle isn't there
+    if not os.path.exists(kindlePath):
+        return None
+    conn.execute('ATTACH DATABASE ? AS kindle', (Path(kindlePath).resolve().as_uri() + '?mode=ro',))
+    try:
+        watermark = lookupsWatermark(conn)
+        if watermark is None:
+            # >= so lookups sharing the newest mirrored millisecond aren't missed
+            since, = conn.execute('SELECT coalesce(max(timestamp), 0) FROM LOOKUPS').fetchone()
+            newLookups, params = 'timestamp >= ?', (since,)
+        else:
+            newLookups, params = 'rowid > ?', (watermark,)
+        if log:
+            # The device is opened read-only, so an index can't be added there;
+            # without the watermark the copy reads all of kindle.LOOKUPS once
+            # and matching relies on the mirror's own indexes
+            log(f'kindle sync watermark: {watermark}')
+            for column in ('timestamp', 'book_key'):
+                log(f'kindle LOOKUPS.{column} indexed: {hasIndex(conn, "kindle", "LOOKUPS", column)}')
+            for detail in queryPlan(conn, f'SELECT id FROM kindle.LOOKUPS WHERE {newLookups}', params):
+                log(f'kindle sync plan: {detail}')
+        # Copied rows, replaced ones included, land after the mirror's last rowid
+        mirrored, = conn.execute('SELECT coalesce(max(rowid), 0) FROM LOOKUPS').fetchone()
+        with conn:
+            copied = conn.execute(f'''
+            INSERT OR REPLACE INTO LOOKUPS (id, word_key, book_key, usage, timestamp)
+            SELECT id, word_key, book_key, usage, timestamp FROM kindle.LOOKUPS
+            WHERE {newLookups}
+            ''', params).rowcount
+            conn.execute('''
+            INSERT OR REPLACE INTO WORDS (id, word, stem, lang, timestamp)
+            SELECT id, word, stem, lang, timestamp FROM kindle.WORDS
+            WHERE id IN (SELECT word_key FROM LOOKUPS WHERE rowid > ?)
+            ''', (mirrored,))
+            conn.execute('''
+            INSERT OR REPLACE INTO BOOK_INFO (id, asin, guid, lang, title, authors)
+            SELECT id, asin, guid, lang, title, authors FROM kindle.BOOK_INFO
+            WHERE id IN (SELECT book_key FROM LOOKUPS WHERE rowid > ?)
+            ''', (mirrored,))
+            conn.execute('DELETE FROM SYNC_WATERMARK')
+            conn.execute('''
+            INSERT INTO SYNC_WATERMARK (lookups_rowid, lookups_id)
+            SELECT rowid, id FROM kindle.LOOKUPS ORDER BY rowid DESC LIMIT 1
+            ''')
+    finally:
+        conn.execute('DETACH DATABASE kindle')
+    return copied
+
+
+TRAILING_PARENTHESES = re.compile(r'[(\[][^()\[\]]*[)\]]$')
+
+
+def normalizeTitle(title):
+    return ''.join(unicodedata.normalize('NFKC', title).replace('\ufeff', '').casefold().split())
+
+
+class BookIndex:
+    # Maps the document names in My Clippings.txt to the BOOK_INFO ids of that
+    # book; a book can have several, e.g. a sample and the bought copy, or a
+    # re-download. Clippings name a book as "title (author)", so failing an
+    # exact match, trailing parentheses are stripped one at a time and then the
+    # longest title the name starts with is taken. That last is only a guess,
+    # e.g. "ワンピース10" starts with "ワンピース1", so it's flagged as one and a
+    # book added later can prove it wrong; names are only remembered for the
+    # life of the index, which is one import.
+    def __init__(self, conn):
+        self.conn = conn
+        titles = {}
+        for bookKey, title in conn.execute('SELECT id, title FROM BOOK_INFO WHERE title IS NOT NULL'):
+            titles.setdefault(normalizeTitle(title), set()).add(bookKey)
+        self._titles = {title: tuple(sorted(bookKeys)) for title, bookKeys in titles.items()}
+        self._resolved = {}
+
+    def resolve(self, document):
+        # A tuple of BOOK_INFO ids, or None if no title fits, and whether the
+        # ids are a guess from the start of the name
+        if document not in self._resolved:
+            self._resolved[document] = self._search(normalizeTitle(document or ''))
+        return self._resolved[document]
+
+    def ofTitle(self, title):
+        # The ids resolve() finds for a book with this BOOK_INFO title
+        return self._titles.get(normalizeTitle(title or ''))
+
+    def _search(self, name):
+        while name:
+            if name in self._titles:
+                return self._titles[name], False
+            stripped = TRAILING_PARENTHESES.sub('', name)
+            if stripped == name:
+                break
+            name = stripped
+        prefixes = [title for title in self._titles if len(title) > 1 and name.startswith(title)]
+        if prefixes:
+            return self._titles[max(prefixes, key=len)], True
+        return None, False
@@ -0,0 +1,38 @@
+import hashlib
+
+from .vocab import cleanVocab
+
+
+def noteKeyOf(sentence, word):
+    # Fixed-size digest so the set stays small however long the sentences are
+    return hashlib.sha1(f'{sentence}\x1f{word}'.encode('utf-8')).digest()
+
+
+def fields(clipping, fieldNames, vocab, config, words, splitter=None, metrics=None, word=None):
+    # config supplies the sentence_field, source_field and word_field names;
+    # word is the highlight already cleaned, as cleanVocab_many does for a chunk
+    content_yielded = False
+    source_yielded = False
+    word_yielded = False
+
+    for field in fieldNames:
+        if field == config['sentence_field']:
+            yield vocab.usage.strip()
+            content_yielded = True
+        elif field == config['source_field']:
+            pg = 'ページ' + clipping.page if clipping.page is not None else ''
+            loc = '位置' + clipping.location if clipping.location is not None else ''
+            yield '{page}{added}{word}'.format(
+                page= pg if pg else loc,
+                added=' ' + clipping.added if clipping.added is not None else '',
+                word=' ' + clipping.content
+            )
+            source_yielded = True
+        elif field == config['word_field']:
+            yield cleanVocab(clipping.content, words, splitter, metrics) if word is None else word
+            word_yielded = True
+        else:
+            yield ''
+
+    if not (content_yielded and source_yielded and word_yielded):
+        raise ValueError('Could not find content and/or source fields in model.')
@@ -0,0 +1,147 @@
+from collections import namedtuple
+from functools import partial
+
+from .clippings import getClippings, chunked
+from .journal import clippingKey
+from .metrics import ImportMetrics
+from .lookups import getLookupsSince, syncVocabLookups, iterVocabLookups, matchClippings, matchLeftovers, closestVocab, noLog
+from .mirror import openMirror, BookIndex
+from .notes import fields, noteKeyOf
+from .splitter import Words
+from .vocab import cleanVocab_many
+
+# keys: journal keys of the clippings the chunk covered, resumed ones excluded;
+# notes: {'fields', 'tags', 'vocab', 'clipping'} per note to add;
+# no_vocab: clippings no lookup could be found for
+ChunkResult = namedtuple('ChunkResult', ('keys', 'notes', 'no_vocab', 'duplicates', 'resumed'))
+
+
+class HighlightPipeline:
+    # Everything an import does short of touching a collection: clippings are
+    # read, matched to their Vocab Builder lookups, cleaned and turned into note
+    # fields a chunk at a time. config has the keys of config.json. debug, if
+    # given, is called as debug(state, vocabs, clipping, vocab, distances) at
+    # each step of matching a clipping. Timings and counts go on self.metrics.
+    def __init__(self, config, mirrorPath, log=noLog, words=None, splitter=None, debug=None):
+        self.config = config
+        self.metrics = ImportMetrics()
+        self.mirrorPath = mirrorPath
+        self.log = log
+        self.words = words
+        self.splitter = splitter
+        self.debug = debug
+        self.seen = 0 # clippings matched so far, for progress
+        self.window = config['mins_since_lookup'] * 60 # seconds either side of a highlight searched first
+        self.lookups = partial(iterVocabLookups, mirrorPath, getLookupsSince(config['last_added']), log=log)
+
+    def clippings(self, path, stats):
+        return getClippings(path, stats, self.config['last_added'], self.config.get('clippings_checkpoint'))
+
+    def sync(self):
+        with self.metrics.stage('sync'):
+            syncVocabLookups(self.mirrorPath, self.config['path'], self.log)
+
+    def chunks(self, clippingStream, fieldNames, seenKeys, committed=(), progress=None):
+        # Yields a ChunkResult per config['chunk_size'] clippings, oldest first.
+        # seenKeys holds the noteKeyOf of every note already added and is added
+        # to; clippings whose journal key is in committed are skipped. Clippings
+        # with no lookup near them in time are held back from their chunk, keys
+        # and all, and come together in one last ChunkResult.
+        with self.metrics.stage('dictionary'):
+            words = self.words or Words()
+        booksConn = openMirror(self.mirrorPath)
+        books = BookIndex(booksConn)
+        try:
+            build = partial(self.chunkResult, fieldNames, seenKeys, words, progress)
+            explain = True
+            leftoverKeys = []
+            leftovers = []
+
+            chunks = chunked(clippingStream, self.config['chunk_size'])
+            while True:
+                # the stream parses as it's read, so this is where parsing happens
+                with self.metrics.stage('parse'):
+                    chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                self.metrics.count('parse', len(chunk))
+                keys = []
+                clippings = []
+                resumed = 0
+                for clipping in chunk:
+                    clippingId = clippingKey(clipping)
+                    if clippingId in committed:
+                        resumed += 1
+                    else:
+                        keys.append(clippingId)
+                        clippings.append(clipping)
+                with self.metrics.stage('match', len(clippings)):
+                    candidates = matchClippings(clippings, books, self.lookups, self.window, explain)
+                explain = False
+
+                found = []
+                for key, clipping, clippingCandidates in zip(keys, clippings, candidates):
+                    if clippingCandidates:
+                        found.append((key, clipping, clippingCandidates))
+                    else:
+                        leftoverKeys.append(key)
+                        leftovers.append(clipping)
+                yield build([key for key, _, _ in found], [clipping for _, clipping, _ in found], [candidates for _, _, candidates in found], resumed)
+
+            if leftovers:
+                with self.metrics.stage('match'):
+                    candidates = matchLeftovers(leftovers, books, self.lookups)
+                yield build(leftoverKeys, leftovers, candidates, 0)
+        finally:
+            booksConn.close()
+            if words is not self.words:
+                words.close()
+
+    def chunkResult(self, fieldNames, seenKeys, words, progress, keys, clippings, candidates, resumed):
+        # The ChunkResult for clippings and their candidates; keys are journaled
+        # once its notes are committed
+        sentenceOrd = fieldNames.index(self.config['sentence_field'])
+        wordOrd = fieldNames.index(self.config['word_field'])
+        matched = []
+        no_vocab = []
+        for clipping, clippingCandidates in zip(clippings, candidates):
+            self.seen += 1
+            if progress:
+                progress.update(f'Parsing New Highlights...\n {clipping.content}', value=self.seen)
+                progress.check()
+            vocab = self.matchVocab(clipping, clippingCandidates)
+            if vocab:
+                matched.append((clipping, vocab))
+            else:
+                no_vocab.append(clipping)
+
+        cleaned = cleanVocab_many([clipping.content for clipping, _ in matched], words, self.splitter, self.metrics)
+        notes = []
+        duplicates = 0
+        for (clipping, vocab), word in zip(matched, cleaned):
+            with self.metrics.stage('notes', 1):
+                noteFields = list(fields(clipping, fieldNames, vocab, self.config, words, self.splitter, self.metrics, word))
+                key = noteKeyOf(noteFields[sentenceOrd], noteFields[wordOrd])
+            if key in seenKeys:
+                duplicates += 1
+                continue
+            seenKeys.add(key)
+            notes.append({"fields": noteFields, "tags": [vocab.authors, vocab.title], "vocab": vocab, "clipping": clipping})
+
+        return ChunkResult(keys, notes, no_vocab, duplicates, resumed)
+
+    def matchVocab(self, clipping, candidates):
+        vocab = closestVocab(candidates)
+        if not vocab:
+            self.metrics.unmatched += 1
+        elif len(candidates) > 1:
+            self.metrics.ambiguous += 1
+        if self.debug:
+            vocabs = [vocab for vocab, _ in candidates]
+            self.debug("before", vocabs, clipping)
+            if vocab:
+                self.debug("distance", vocabs, clipping, vocab, [distance for _, distance in candidates])
+                self.debug("after", vocabs, clipping, vocab)
+            else:
+                self.debug("notFound", vocabs, clipping)
+        return vocab
@@ -0,0 +1,92 @@
+import json
+import os
+import threading
+from datetime import datetime
+
+LEVELS = {'debug': 10, 'info': 20, 'warning': 30, 'error': 40}
+
+MAX_BYTES = 1 << 20 # the log rolls over to path.1 once it grows past this
+BACKUPS = 3 # rolled over logs kept, path.1 being the newest
+BUFFER_SIZE = 500 # records held before they're written out
+
+
+class RunLog:
+    # A leveled log that keeps one file handle open for the whole run and writes
+    # records a buffer at a time. Each record is a line of JSON with its time,
+    # level and message plus any keyword fields passed with it. Warnings and
+    # errors are written straight away, as is everything on flush() or close().
+    # Calling the log itself logs at info, so it can stand in for a plain
+    # log(line) function.
+    def __init__(self, path, level='info', maxBytes=MAX_BYTES, backups=BACKUPS, bufferSize=BUFFER_SIZE):
+        self.path = path
+        self.level = LEVELS[level]
+        self.maxBytes = maxBytes
+        self.backups = backups
+        self.bufferSize = bufferSize
+        self._buffer = []
+        self._file = None
+        self._lock = threading.Lock()
+
+    def enabled(self, level):
+        return LEVELS[level] >= self.level
+
+    def log(self, level, message, **fields):
+        levelNo = LEVELS[level]
+        if levelNo < self.level:
+            return
+        record = {'time': datetime.now().isoformat(timespec='milliseconds'), 'level': level, 'message': message}
+        record.update(fields)
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self._lock:
+            self._buffer.append(line)
+            if len(self._buffer) >= self.bufferSize or levelNo >= LEVELS['warning']:
+                self._write()
+
+    def debug(self, message, **fields):
+        self.log('debug', message, **fields)
+
+    def info(self, message, **fields):
+        self.log('info', message, **fields)
+
+    def warning(self, message, **fields):
+        self.log('warning', message, **fields)
+
+    def error(self, message, **fields):
+        self.log('error', message, **fields)
+
+    __call__ = info
+
+    def flush(self):
+        with self._lock:
+            self._write()
+
+    def close(self):
+        # The file is opened again if anything is logged afterwards
+        with self._lock:
+            self._write()
+            if self._file:
+                self._file.close()
+                self._file = None
+
+    def _write(self):
+        if not self._buffer:
+            return
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self._file = open(self.path, 'a', encoding='utf-8')
+        self._file.write('\n'.join(self._buffer) + '\n')
+        self._buffer.clear()
+        self._file.flush()
+        if self._file.tell() >= self.maxBytes:
+            self._rollOver()
+
+    def _rollOver(self):
+        self._file.close()
+        self._file = None
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f'{self.path}.{i}'):
+                os.replace(f'{self.path}.{i}', f'{self.path}.{i + 1}')
+        if self.backups:
+            os.replace(self.path, f'{self.path}.1')
+        else:
+            os.remove(self.path)
@@ -8,8 +8,9 @@
 # License: GNU AGPL, version 3 or later; http://www.gnu.org/licenses/agpl.html
 #
 
-import os, subprocess, json
-from anki.utils import isWin
+import os, sys, shutil, subprocess, json, mmap, struct, queue, threading
+from concurrent.futures import ThreadPoolExecutor
+from collections import namedtuple
 from pathlib import Path
 
 """
@@ -24,41 +25,103 @@ w.writeCustomDictionary()
 
 print(w.contains('腰斬'))
 """
+isWin = sys.platform.startswith("win32")
+# The dictionary lives in the add-on folder, one up from core
+ADDON_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+DICT_SOURCE = os.path.join(ADDON_DIR, "jmdict_freqs.txt")
+DICT_COMPILED = os.path.join(ADDON_DIR, "jmdict_freqs.bin")
+
+# Compiled dictionary layout: header, then count+1 uint32 offsets, then every
+# expression and reading as sorted, deduplicated utf-8 keys laid end to end.
+# The source's mtime and size are kept in the header so edits trigger a rebuild.
+DICT_MAGIC = b'KJDICT01'
+DICT_HEADER = struct.Struct('<8sqqI4x')
+DICT_OFFSET = struct.Struct('<I')
+MAX_BATCH = 256 # most expressions sent to one MeCab process in a round trip
+
+def readDictSource(dFile):
+    with open(dFile, "rb") as f:
+        for line in f:
+            parts = line.decode("utf-8").rstrip("\r\n").split("\t")
+            if not parts[0].startswith("#") and len(parts) == 3:
+                yield parts[0], parts[1]
+
+def compileDictionary(dFile=DICT_SOURCE, outFile=DICT_COMPILED):
+    stat = os.stat(dFile)
+    keys = set()
+    for expression, reading in readDictSource(dFile):
+        keys.add(expression.encode("utf-8"))
+        keys.add(reading.encode("utf-8"))
+    keys = sorted(keys)
+
+    tmpFile = outFile + '.tmp'
+    with open(tmpFile, "wb") as out:
+        out.write(DICT_HEADER.pack(DICT_MAGIC, stat.st_mtime_ns, stat.st_size, len(keys)))
+        offset = 0
+        for key in keys:
+            out.write(DICT_OFFSET.pack(offset))
+            offset += len(key)
+        out.write(DICT_OFFSET.pack(offset))
+        for key in keys:
+            out.write(key)
+    os.replace(tmpFile, outFile)
+
+def isDictionaryStale(dFile=DICT_SOURCE, outFile=DICT_COMPILED):
+    if not os.path.exists(outFile):
+        return True
+    try:
+        stat = os.stat(dFile)
+    except FileNotFoundError:
+        # Nothing to rebuild from; keep using what was compiled last time
+        return False
+    with open(outFile, "rb") as f:
+        header = f.read(DICT_HEADER.size)
+    if len(header) < DICT_HEADER.size:
+        return True
+    magic, mtime, size, _ = DICT_HEADER.unpack(header)
+    return magic != DICT_MAGIC or mtime != stat.st_mtime_ns or size != stat.st_size
+
 class Words:
 
-    def __init__(self,):
+    def __init__(self, dFile=DICT_SOURCE, compiledFile=DICT_COMPILED):
         self._dic = {}  #dic[expression][reading] = WordInfo(...)
         self._dicT = {} #dicT[expression][reading] = 1
         self.temp_dict = {}
-        countWords = 0
-        linesMissed = 0
-        dFile = os.path.join(os.path.dirname(os.path.realpath(__file__)), "jmdict_freqs.txt")
-        with open(dFile, "rb") as f:
-            for line in f:
-                parts = line.decode("utf-8").rstrip("\r\n").split("\t")
-                if not parts[0].startswith("#") and len(parts) == 3:
-                    countWords += 1
-                    expression = parts[0]
-                    reading = parts[1]
-                    # pris = set() if parts[2] == "" else set(parts[2].split(","))
-                    # wordInfo = WordInfo(pris)
-                    # for pri in pris:
-                    #     if pri.startswith("nf"):
-                    #         wordInfo.nf = int(pri[2:])
-                    self.add(expression, reading)
-                else:
-                    linesMissed += 1
-        
-    
+        if isDictionaryStale(dFile, compiledFile):
+            compileDictionary(dFile, compiledFile)
+        with open(compiledFile, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        _, _, _, self._count = DICT_HEADER.unpack_from(self._mm, 0)
+        self._keysStart = DICT_HEADER.size + DICT_OFFSET.size * (self._count + 1)
+
+    def close(self):
+        self._mm.close()
+
+    def _key(self, i):
+        start, = DICT_OFFSET.unpack_from(self._mm, DICT_HEADER.size + DICT_OFFSET.size * i)
+        end, = DICT_OFFSET.unpack_from(self._mm, DICT_HEADER.size + DICT_OFFSET.size * (i + 1))
+        return self._mm[self._keysStart + start:self._keysStart + end]
+
+    def _compiledContains(self, v):
+        key = v.encode("utf-8")
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo < self._count and self._key(lo) == key
+
     def writeCustomDictionary(self):
-        dFile = os.path.join(os.path.dirname(os.path.realpath(__file__)), "dicts")
+        dFile = os.path.join(ADDON_DIR, "dicts")
         for path in Path(dFile).rglob('term_bank_*.json'):
             print(path)
             self.readJsonFile(path)
         self.writeTempDict()
 
     def writeTempDict(self):
-        with open(os.path.join(os.path.dirname(os.path.realpath(__file__)), "dicts", 'newDict.txt'), 'a', encoding="utf8") as outfile:
+        with open(os.path.join(ADDON_DIR, "dicts", 'newDict.txt'), 'a', encoding="utf8") as outfile:
             for k, entry in self.temp_dict.items():
                 outfile.write(f"{entry['expression']}\t{entry['reading']}\t\n")
 
@@ -93,7 +156,8 @@ class Words:
     
     def contains(self, v):
         # return expression in dic and reading in dic[expression]
-        return (v in self._dic) or (v in self._dicT)
+        # words added at runtime (writeCustomDictionary) live in the dicts, the rest in the compiled file
+        return (v in self._dic) or (v in self._dicT) or self._compiledContains(v)
     # def _learnFull(self, expression, reading, kanjiKnown, kanaKnown):
     #     if self.contains(expression, reading):
     #         justLearnedKanji = self._dic[expression][reading].learnKanji(kanjiKnown)
@@ -172,61 +236,297 @@ class Splitter:
             try:
                 japanese = __import__("3918629684")
             except:
+                japanese = None
+        if japanese is None:
+            # Outside Anki, e.g. from the command line, use a MeCab on the PATH
+            self.jpr = None
+            mecab = shutil.which("mecab")
+            if not mecab:
                 raise Exception('Failed to import Japanese Support module')
-        self.jpr = japanese.reading
-        try:
-            supportDir = self.jpr.supportDir
-        except:
-            supportDir = "../../addons/japanese/support/"
-        
-        mecabCmd = self.jpr.mungeForPlatform(
-            [os.path.join(supportDir, "mecab")] + mecabArgs + [
-                '-d', supportDir, '-r', os.path.join(supportDir,"mecabrc"),
-                '-u', os.path.join(supportDir, "user_dic.dic")])
-        os.environ['DYLD_LIBRARY_PATH'] = supportDir
-        os.environ['LD_LIBRARY_PATH'] = supportDir
-        
+            mecabCmd = [mecab] + mecabArgs
+            startupinfo = None
+        else:
+            self.jpr = japanese.reading
+            try:
+                supportDir = self.jpr.supportDir
+            except:
+                supportDir = "../../addons/japanese/support/"
+
+            mecabCmd = self.jpr.mungeForPlatform(
+                [os.path.join(supportDir, "mecab")] + mecabArgs + [
+                    '-d', supportDir, '-r', os.path.join(supportDir,"mecabrc"),
+                    '-u', os.path.join(supportDir, "user_dic.dic")])
+            os.environ['DYLD_LIBRARY_PATH'] = supportDir
+            os.environ['LD_LIBRARY_PATH'] = supportDir
+            startupinfo = self.jpr.si
+
         try:
-            if not isWin:
+            if self.jpr and not isWin:
                 os.chmod(mecabCmd[0], 0o755)
             self.mecab = subprocess.Popen(
                 mecabCmd, bufsize=-1, stdin=subprocess.PIPE,
                 stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
-                startupinfo=self.jpr.si)
+                startupinfo=startupinfo)
         except OSError:
             raise Exception("Failed to run MeCab at %s" % mecabCmd[0])
 
     def analyze(self, expr):
-        expr = self.jpr.escapeText(expr)
-        self.mecab.stdin.write(expr.encode("utf-8", "ignore") + b'\n')
-        self.mecab.stdin.flush()
-        expr = self.mecab.stdout.readline().rstrip(b'\r\n').decode("utf-8", "replace")
-        word = expr.split("	")[0]
-        deconj = expr.split(",")[6]
-        return word if deconj == '*' else deconj 
+        return dictionaryForm(expr, self.tokenize(expr))
+
+    def analyze_many(self, exprs):
+        exprs = list(exprs)
+        return [dictionaryForm(expr, tokens) for expr, tokens in zip(exprs, self.tokenize_many(exprs))]
+
+    def tokenize(self, expr):
+        return self.tokenize_many([expr])[0]
+
+    def tokenize_many(self, exprs):
+        # One line in, one EOS-terminated block out per expression. Everything is
+        # written from a separate thread while this one reads, so neither side can
+        # block on a full pipe buffer however large the batch is.
+        escape = self.jpr.escapeText if self.jpr else str
+        lines = [escape(expr).replace('\r', ' ').replace('\n', ' ').encode("utf-8", "ignore") + b'\n' for expr in exprs]
+        writeErrors = []
+
+        def write():
+            try:
+                self.mecab.stdin.write(b''.join(lines))
+                self.mecab.stdin.flush()
+            except OSError as e:
+                writeErrors.append(e)
+
+        writer = threading.Thread(target=write, daemon=True)
+        writer.start()
+        results = []
+        tokens = []
+        while len(results) < len(lines):
+            raw = self.mecab.stdout.readline()
+            if not raw:
+                writer.join()
+                raise writeErrors[0] if writeErrors else OSError('MeCab exited mid-sentence')
+            line = raw.rstrip(b'\r\n').decode("utf-8", "replace")
+            if line == 'EOS':
+                results.append(tokens)
+                tokens = []
+            else:
+                tokens.append(parseToken(line))
+        writer.join()
+        return results
+
+    def alive(self):
+        return self.mecab.poll() is None
+
+    def close(self):
+        try:
+            self.mecab.stdin.close()
+            self.mecab.wait(timeout=2)
+        except (OSError, subprocess.TimeoutExpired):
+            self.mecab.kill()
+        self.mecab.stdout.close()
+
+class SplitterPool:
+    # Keeps up to `size` MeCab processes alive and hands each call to an idle one.
+    # Processes are started lazily, and one that has died is replaced on its next use.
+    def __init__(self, size=None):
+        self.size = size or os.cpu_count() or 1
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._started = 0
+        self._closed = False
+        self._executor = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix='mecab')
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('MeCab pool is shut down')
+            spawn = self._started < self.size
+            if spawn:
+                self._started += 1
+        if not spawn:
+            return self._idle.get()
+        try:
+            return Splitter()
+        except Exception:
+            with self._lock:
+                self._started -= 1
+            raise
+
+    def _release(self, splitter):
+        with self._lock:
+            closed = self._closed
+        if closed:
+            splitter.close()
+        else:
+            self._idle.put(splitter)
+
+    def _restart(self, splitter):
+        splitter.close()
+        return Splitter()
+
+    def _call(self, method, arg):
+        splitter = self._acquire()
+        try:
+            if not splitter.alive():
+                splitter = self._restart(splitter)
+            try:
+                result = getattr(splitter, method)(arg)
+            except (OSError, ValueError, IndexError):
+                if splitter.alive():
+                    raise
+                # MeCab died mid-call; retry once on a fresh process
+                splitter = self._restart(splitter)
+                result = getattr(splitter, method)(arg)
+        except Exception:
+            with self._lock:
+                self._started -= 1
+            splitter.close()
+            raise
+        self._release(splitter)
+        return result
+
+    def analyze(self, expr):
+        return self._call('analyze', expr)
+
+    def submit(self, expr):
+        return self._executor.submit(self.analyze, expr)
+
+    def tokenize_many(self, exprs, batchSize=None):
+        # Each batch is a single pipelined round trip on one process; batches run
+        # side by side. By default they're sized so every process gets a share.
+        exprs = list(exprs)
+        if batchSize is None:
+            batchSize = min(MAX_BATCH, max(1, -(-len(exprs) // self.size)))
+        batches = [exprs[i:i + batchSize] for i in range(0, len(exprs), batchSize)]
+        results = []
+        for tokens in self._executor.map(lambda batch: self._call('tokenize_many', batch), batches):
+            results.extend(tokens)
+        return results
+
+    def analyze_many(self, exprs, batchSize=None):
+        exprs = list(exprs)
+        return [dictionaryForm(expr, tokens) for expr, tokens in zip(exprs, self.tokenize_many(exprs, batchSize))]
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+        self._executor.shutdown(wait=True)
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+def getSplitterPool():
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            _POOL = SplitterPool()
+        return _POOL
+
+def shutdownSplitterPool():
+    global _POOL
+    with _POOL_LOCK:
+        pool, _POOL = _POOL, None
+    if pool is not None:
+        pool.close()
+
+class PassThroughSplitter:
+    # Stands in for the pool where MeCab isn't available: words are left as they are
+    def analyze(self, expr):
+        return expr
+
+    def analyze_many(self, exprs, batchSize=256):
+        return list(exprs)
+
+    def close(self):
+        pass
+
+Token = namedtuple('Token', ('surface', 'pos', 'base', 'reading'))
+
+def parseToken(line):
+    # surface\tpos,pos1,pos2,pos3,conjugation type,conjugation form,base,reading,pronunciation
+    # Unknown words stop after the conjugation form, so base and reading may be missing
+    surface, _, feature = line.partition('\t')
+    features = feature.split(',')
+    return Token(
+        surface=surface,
+        pos=features[0],
+        base=features[6] if len(features) > 6 else '*',
+        reading=features[7] if len(features) > 7 else '',
+    )
+
+def dictionaryForm(expr, tokens):
+    # The base form of the first token, or its surface when MeCab has no base form for it
+    if not tokens:
+        return expr
+    token = tokens[0]
+    return token.surface if token.base == '*' else token.base
 
 def rreplace(s, old, new, occurrence):
     li = s.rsplit(old, occurrence)
     return new.join(li)
 
+def buildSuffixTrie(conjugations):
+    # Rules are keyed by their inflected ending read backwards, so every rule
+    # that matches a term is found in one walk from the term's last character.
+    # Each node is {char: node}, with the rules ending there kept under None as
+    # (rule index, inflected length, dictionary endings, prefix).
+    trie = {}
+    for index, c in enumerate(conjugations):
+        node = trie
+        for char in reversed(c['inflected']):
+            node = node.setdefault(char, {})
+        node.setdefault(None, []).append((index, len(c['inflected']), c['dict'], c.get('prefix')))
+    return trie
+
+def matchingRules(term):
+    rules = []
+    node = _SUFFIX_TRIE
+    for char in reversed(term):
+        node = node.get(char)
+        if node is None:
+            break
+        rules.extend(node.get(None, ()))
+    # Keep CONJUGATIONS order so the candidates come out as they always have
+    rules.sort()
+    return rules
+
 def deconjugate(term):
     deconjugations = []
-    for c in CONJUGATIONS:
-        if term.endswith(c['inflected']): 
-            for x in c['dict']:
-                deinflected = rreplace(term, c['inflected'], x, 1)
-                if 'prefix' in c:
-                    prefix = c['prefix']
-                    if deinflected.startswith(prefix):
-                        deprefixedDeinflected =  deinflected[len(prefix):]
-                        if deprefixedDeinflected not in deconjugations:
-                            deconjugations.append(deprefixedDeinflected)
-                if deinflected not in deconjugations:
-                    deconjugations.append(deinflected)
-    deconjugations = list(filter(lambda x: len(x) > 1, deconjugations))  
-    deconjugations.insert(0, term)    
+    seen = set()
+    for _, length, endings, prefix in matchingRules(term):
+        stem = term[:-length]
+        for x in endings:
+            deinflected = stem + x
+            if prefix is not None and deinflected.startswith(prefix):
+                deprefixedDeinflected = deinflected[len(prefix):]
+                if deprefixedDeinflected not in seen:
+                    seen.add(deprefixedDeinflected)
+                    deconjugations.append(deprefixedDeinflected)
+            if deinflected not in seen:
+                seen.add(deinflected)
+                deconjugations.append(deinflected)
+    deconjugations = [x for x in deconjugations if len(x) > 1]
+    deconjugations.insert(0, term)
     return deconjugations
 
+def deconjugate_many(terms):
+    # Highlights repeat a lot across a backlog, so each distinct term is only walked once
+    cache = {}
+    results = []
+    for term in terms:
+        if term not in cache:
+            cache[term] = deconjugate(term)
+        results.append(list(cache[term]))
+    return results
+
 
 CONJUGATIONS = [{"inflected":"くありませんでした","dict":["い"]},
 {"inflected":"いませんでした","dict":["う"]},
@@ -1153,4 +1453,6 @@ CONJUGATIONS = [{"inflected":"くありませんでした","dict":["い"]},
 {"inflected":"たせられたくない","dict":["つ"]},
 {"inflected":"たせられたくて","dict":["つ"]},
 {"inflected":"たせられたく","dict":["つ"]}
-]
\ No newline at end of file
+]
+
+_SUFFIX_TRIE = buildSuffixTrie(CONJUGATIONS)
@@ -0,0 +1,82 @@
+import re
+from contextlib import nullcontext
+
+from .splitter import deconjugate, getSplitterPool
+from .metrics import TIER_DICTIONARY, TIER_DECONJUGATION, TIER_MECAB
+
+BLACKLIST = ['‐', '・', '△', '×']
+
+
+def deinflectVocab(vocab, words, splitter=None, metrics=None):
+    word, tier = resolveVocab(vocab, words, splitter)
+    if metrics:
+        metrics.resolvedBy(tier)
+    return word
+
+
+def resolveVocab(vocab, words, splitter=None):
+    # The word and which tier found it: the dictionary, a deconjugation, or MeCab
+    found = dictionaryWord(vocab, words)
+    if found:
+        return found
+
+    # Resort to mecab breaking things into individual words
+    try:
+        wordItems = (splitter or getSplitterPool()).analyze(vocab)
+        return wordItems, TIER_MECAB
+    except Exception as e:
+        raise Exception(str(e)+"\nCan't do sentence scan: check Japanese Support is installed and working properly")
+
+def dictionaryWord(vocab, words):
+    # The tiers short of MeCab; None when neither finds the word
+
+    if words.contains(vocab):
+        return vocab, TIER_DICTIONARY
+
+    # Use basic deconjugation rules to guess a word
+    deconjugations = deconjugate(vocab)
+    for dc in deconjugations:
+        if words.contains(dc):
+            return dc, TIER_DECONJUGATION
+    return None
+
+def removeExtraChars(v):
+    regex = u'([\u4E00-\u9FFF]|[\u3040-\u309Fー]|[\u30A0-\u30FF])+'
+    match = re.search(regex, v, re.U)
+    try:
+        return match[0]
+    except TypeError: # things like ａｍｐｍ
+        return v
+
+def cleanVocab(v, words, splitter=None, metrics=None):
+    # words is a splitter.Words; splitter defaults to the shared MeCab pool
+    with metrics.stage('clean_vocab', 1) if metrics else nullcontext():
+        # cleaned = "".join(c for c in v if c not in BLACKLIST)
+        cleaned = removeExtraChars(v)
+        deinflected = deinflectVocab(cleaned, words, splitter, metrics)
+    return deinflected
+
+def cleanVocab_many(vs, words, splitter=None, metrics=None):
+    # cleanVocab for each of vs, in order. Each distinct word is resolved once:
+    # the dictionary tiers first, then whatever they leave to MeCab in one batch
+    with metrics.stage('clean_vocab', len(vs)) if metrics else nullcontext():
+        cleaned = [removeExtraChars(v) for v in vs]
+        distinct = list(dict.fromkeys(cleaned))
+        found = [dictionaryWord(term, words) for term in distinct]
+        rest = [term for term, result in zip(distinct, found) if result is None]
+        mecab = {}
+        if rest:
+            try:
+                mecab = dict(zip(rest, (splitter or getSplitterPool()).analyze_many(rest)))
+            except Exception as e:
+                raise Exception(str(e)+"\nCan't do sentence scan: check Japanese Support is installed and working properly")
+        resolved = {term: result or (mecab[term], TIER_MECAB) for term, result in zip(distinct, found)}
+
+        deinflected = []
+        for term in cleaned:
+            word, tier = resolved[term]
+            if metrics:
+                metrics.resolvedBy(tier)
+            deinflected.append(word)
+    return deinflected
+
@@ -1,45 +1,46 @@
 from datetime import datetime
-import re
-import sqlite3
-import locale
+import threading
+import time
 import os.path
 from collections import namedtuple
+from concurrent.futures import Future
 
-from anki.decks import DeckManager
 from anki.notes import Note
 from aqt import mw
 from aqt.utils import getFile, showInfo, showText
-from aqt.qt import QAction
-from anki.utils import ids2str
-from .splitter import deconjugate, Splitter, Words
+from aqt.qt import QAction, QPushButton
+from anki.utils import ids2str, splitFields
+from .core.splitter import Words
+from .core.journal import ImportJournal
+from .core.clippingdates import parse_clipping_added
+from .core.clippings import ClippingStats
+from .core.notes import noteKeyOf
+from .core.pipeline import HighlightPipeline
+from .core.runlog import RunLog
+from .core import vocab as coreVocab
 
 
-locale.setlocale(locale.LC_ALL, 'ja_JP')
-
 CONFIG = mw.addonManager.getConfig(__name__)
 
-BLACKLIST = ['‐', '・', '△', '×']
-
-Clipping = namedtuple('Clipping', ('kind', 'document', 'page', 'location', 'added', 'content'))
-Vocab = namedtuple('Vocab', ('stem', 'word', 'usage', 'timestamp', 'title', 'authors'))
-
 VALID_WORDS = None
-# LOOKUP_TO_HIGHLIGHT_THRESHOLD = CONFIG['mins_since_lookup'] * 60 * 1000 # 2 mins in unix timestamp
+MIRROR_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'user_files', 'vocab_mirror.db')
+JOURNAL_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'user_files', 'import_journal.jsonl')
 
-MECABHITS = 0
+PROGRESS_INTERVAL = 0.25 # seconds between progress window repaints
+NOTE_KEY_BATCH = 5000 # notes read per trip to the main thread when keying existing notes
 
 #DEBUG vars
 # Doesn't update timestamp. Turns off loading indicators to make it easier to showInfo
 DEBUG = False
-currentTime = datetime.now().strftime("%Y-%m-%d_%H%M")
-logName = "kindleAnki" + "_%s.log" % currentTime
+logName = "kindleAnki.log"
 logPath = os.path.normpath(os.path.join(mw.col.media.dir(), "..", logName)) 
+reportPath = os.path.splitext(logPath)[0] + ".json" # per-stage timings of the last import
 DEBUG_VOCAB = "虎視眈々"
 DETAILED_LOGS = False
 
-def log(logLine):
-    with open(logPath, "a+", encoding="utf-8") as logFile:
-        logFile.write(f'{logLine}\n')
+# log(line) logs at info; log.debug(line) and the rest at their own level.
+# Records are buffered and written when the import finishes.
+log = RunLog(logPath, 'debug' if DEBUG else CONFIG['log_level'])
 
 def getVocabTimestamp(timestamp):
     return datetime.fromtimestamp(timestamp/1000).strftime('%Y-%m-%d %H:%M:%S')
@@ -51,88 +52,104 @@ def vocabDebug(state, vocabs, clipping=None, vocab=None, distances=None):
     # clipping_in_vocabs = False
     debug_in_vocabs = len([v for v in vocabs if DEBUG_VOCAB in v.usage])
     if clipping:
-        added = parse_clipping_added(clipping.added)
-    lastVocabTimestamp = getVocabTimestamp(vocabs[0].timestamp)
+        added = datetime.fromtimestamp(clipping.timestamp) if clipping.timestamp is not None else None
+    lastVocabTimestamp = getVocabTimestamp(vocabs[0].timestamp) if vocabs else None
     if state == 'before':
-        log(f'bfore slice: {len(vocabs)}, debug_in_vocabs: {debug_in_vocabs}, ClippingTimestamp:{added}, last timestamp: {lastVocabTimestamp}')
+        log.debug(f'bfore slice: {len(vocabs)}, debug_in_vocabs: {debug_in_vocabs}, ClippingTimestamp:{added}, last timestamp: {lastVocabTimestamp}')
     elif state == 'after':
         vocabTimestamp = None
         if (vocab):
             vocabTimestamp = getVocabTimestamp(vocab.timestamp)
-        log(f'after slice: {len(vocabs)}, debug_in_vocabs: {debug_in_vocabs}, ClippingTimestamp:{added}, last timestamp: {lastVocabTimestamp}, VocabTimestamp: {vocabTimestamp}, clipping content: {clipping.content}, title: {clipping.document}, vocab usage: {vocab.usage}')
+        log.debug(f'after slice: {len(vocabs)}, debug_in_vocabs: {debug_in_vocabs}, ClippingTimestamp:{added}, last timestamp: {lastVocabTimestamp}, VocabTimestamp: {vocabTimestamp}, clipping content: {clipping.content}, title: {clipping.document}, vocab usage: {vocab.usage}')
         if DETAILED_LOGS:
             for i, v in enumerate(vocabs):
-                log([f"{i} Vocab Usage: {v.usage} Timestamp: {getVocabTimestamp(v.timestamp)}\n"])
+                log.debug([f"{i} Vocab Usage: {v.usage} Timestamp: {getVocabTimestamp(v.timestamp)}\n"])
     elif state == 'notFound':
-        log(f'ntFnd slice: {len(vocabs)}, debug_in_vocabs: {debug_in_vocabs}, ClippingTimestamp:{added}, last timestamp: {lastVocabTimestamp}')
+        log.debug(f'ntFnd slice: {len(vocabs)}, debug_in_vocabs: {debug_in_vocabs}, ClippingTimestamp:{added}, last timestamp: {lastVocabTimestamp}')
     elif state == "distance":
         vocabTimestamp = getVocabTimestamp(vocab.timestamp)
-        log(f'dstnc slice: {len(vocabs)}, debug_in_vocabs: {debug_in_vocabs}, ClippingTimestamp:{added}, last timestamp: {lastVocabTimestamp}, VocabTimestamp: {vocabTimestamp}, clipping content: {clipping.content}, title: {clipping.document}, vocab usage: {vocab.usage}, distance: {distances}')
+        log.debug(f'dstnc slice: {len(vocabs)}, debug_in_vocabs: {debug_in_vocabs}, ClippingTimestamp:{added}, last timestamp: {lastVocabTimestamp}, VocabTimestamp: {vocabTimestamp}, clipping content: {clipping.content}, title: {clipping.document}, vocab usage: {vocab.usage}, distance: {distances}')
     else:
-        log(f'---OG slice: {len(vocabs)}, debug_in_vocabs: {debug_in_vocabs}')
+        log.debug(f'---OG slice: {len(vocabs)}, debug_in_vocabs: {debug_in_vocabs}')
 
 
 def getDeck(vocab):
     return mw.col.decks.id(CONFIG['deck_name'] + '::' + vocab.title)
 
 
-def getClippings(path):
-    
-    with open(path, encoding='utf-8') as file:
-        lower_path = path.lower()
-        if lower_path.endswith('txt'):
-            clippings, bad_clippings = parse_text_clippings(file)
-        elif lower_path.endswith('html'):
-            clippings, bad_clippings = parse_html_clippings(file)
-        else:
-            raise RuntimeError(f'Unknown extension in path: {path!r}')
-
-
-    highlight_clippings = list(highlights_only(clippings))
-    clippings_to_add = after_last_added(highlight_clippings, last_added_datetime())
-    return highlight_clippings, clippings_to_add, bad_clippings, clippings
+def writeNotes(model, pendingNotes):
+    # One save per batch; each book's deck is resolved once and all of its
+    # cards are moved there with a single setDeck
+    if not pendingNotes:
+        return
+    deckIds = {}
+    notesByDeck = {}
+    for pendingNote in pendingNotes:
+        vocab = pendingNote['vocab']
+        if vocab.title not in deckIds:
+            deckIds[vocab.title] = getDeck(vocab)
+        note = Note(mw.col, model)
+        note.fields = pendingNote['fields']
+        for tag in pendingNote['tags']:
+            note.addTag(tag)
+        mw.col.addNote(note)
+        notesByDeck.setdefault(deckIds[vocab.title], []).append(note.id)
+    for deckId, nids in notesByDeck.items():
+        cids = mw.col.db.list(f'select id from cards where nid in {ids2str(nids)}')
+        mw.col.decks.setDeck(cids, deckId)
+    mw.col.save()
+
+
+def displayResults(stats, addedNotes, duplicates=0, resumed=0, metrics=None):
+    def info():
+        if stats.to_add:
+            yield f'{addedNotes} new highlights imported'
 
+        if resumed:
+            yield f'{resumed} highlights already imported by an interrupted run'
 
-def displayResults(highlight_clippings, clippings_to_add, bad_clippings, clippings, addedNotes):
-    def info():
-        if clippings_to_add:
-            yield f'{len(addedNotes)} new highlights imported'
+        if duplicates:
+            yield f'{duplicates} duplicate highlights skipped'
 
-        num_old_highlights = len(highlight_clippings) - len(clippings_to_add)
+        num_old_highlights = stats.highlights - stats.to_add
         if num_old_highlights:
             yield f'{num_old_highlights} old highlights ignored'
 
-        num_not_highlights = len(clippings) - len(highlight_clippings)
+        num_not_highlights = stats.clippings - stats.highlights
         if num_not_highlights:
             yield f'{num_not_highlights} non-highlight clippings ignored'
 
     
-    if bad_clippings:
-        showText(f'The following {len(bad_clippings)} clippings could not be parsed:\n\n' + '\n==========\n'.join(bad_clippings))
+    if stats.bad_clippings:
+        showText(f'The following {len(stats.bad_clippings)} clippings could not be parsed:\n\n' + '\n==========\n'.join(stats.bad_clippings))
 
     info_strings = list(info())
+    summary = f'\n\n{metrics.summary()}' if metrics and stats.to_add else ''
     if info_strings:
-        showInfo(', '.join(info_strings) + '.')
+        showInfo(', '.join(info_strings) + '.' + summary)
     else:
         showInfo('No clippings found.')
 
 
-def setLastAdded(last_added):
-    if last_added:
-        if not DEBUG:
-            CONFIG['last_added'] = parse_clipping_added(last_added).isoformat()
-            mw.addonManager.writeConfig(__name__, CONFIG)    
+def setLastAdded(last_added, checkpoint=None):
+    if DEBUG:
+        return
+    added = parse_clipping_added(last_added)
+    if added:
+        CONFIG['last_added'] = added.isoformat()
+    if checkpoint:
+        CONFIG['clippings_checkpoint'] = dict(checkpoint, last_added=CONFIG['last_added'])
+    if added or checkpoint:
+        mw.addonManager.writeConfig(__name__, CONFIG)
 
             
-def hasDuplicateHighlightMatches(clipping, vocabs):
+def hasDuplicateHighlightMatches(clipping, candidates):
     seen = {}
     dupes = []
 
-    for vocab in vocabs:
-        if clipping.content not in vocab.usage:
-            continue
+    for vocab, _ in candidates:
         if clipping.content == '■':
-            showInfo(str([vocab.usage for vocab in vocabs]))
+            showInfo(str([vocab.usage for vocab, _ in candidates]))
         if vocab.usage not in seen:
             seen[vocab.usage] = True
         else:
@@ -145,108 +162,25 @@ def hasDuplicateHighlightMatches(clipping, vocabs):
     return False
 
 
-
-def after_last_added(clippings, last_added):
-    if not last_added:
-        return clippings
-
-    def reversed_clippings_after_last_added():
-        for clipping in reversed(clippings):
-            if clipping.added:
-                clipping_added = parse_clipping_added(clipping.added)
-                if clipping_added and clipping_added <= last_added:
-                    return
-            yield clipping
-
-    clippings_after_last_added = list(reversed_clippings_after_last_added())
-    clippings_after_last_added.reverse()
-    return clippings_after_last_added
-
-
-def parse_clipping_added(clipping_added):
-    return datetime.strptime(clipping_added, '%Y年%m月%d日%A %H:%M:%S')
-
-
-def last_added_datetime():
-    last_added_config = CONFIG['last_added']
-    return datetime.strptime(last_added_config, '%Y-%m-%dT%H:%M:%S') if last_added_config else None
-
-
-
-def create_connection():
-    path = os.path.join(CONFIG['path'], 'system', 'vocabulary', 'vocab.db')
-    return sqlite3.connect(path)
-
-def getTimestamp():
-    longAgo = 1362301382
-    if CONFIG['last_added']:
-        # time since last round, minus a day
-        ts = datetime.strptime(CONFIG['last_added'], '%Y-%m-%dT%H:%M:%S').timestamp() - 86400
-    else:
-        ts = longAgo
-    return ts
-
-def convertToVocab(rows):
-    vocabs = []
-    for row in rows:
-        try:
-            vocabs.append()
-        except:
-            pass
-    return vocabs
-
-
-def getVocabLookups():
-    conn = create_connection()
-    # sqlite3.OperationalError: Could not decode to UTF-8 column 'usage' with text; Happens with blob data?
-    conn.text_factory = lambda b: b.decode(errors = 'ignore')
-    cur = conn.cursor()
-    timestamp = getTimestamp()
-    sql = f'''
-    select WORDS.stem, WORDS.word, LOOKUPS.usage, LOOKUPS.timestamp, BOOK_INFO.title, BOOK_INFO.authors
-    from LOOKUPS left join WORDS
-    on WORDS.id = LOOKUPS.word_key
-    left join BOOK_INFO
-    on BOOK_INFO.id = LOOKUPS.book_key
-    WHERE DATETIME(LOOKUPS.timestamp/1000, 'unixepoch') > DATETIME({timestamp}, 'unixepoch')
-	ORDER BY LOOKUPS.timestamp DESC;
-    '''
-    cur.execute(sql)
-    
-    return [Vocab(*row) for row in cur.fetchall()]
-
-def getTimestampDistance(clipping, vocab):
-    
-    clippingTimestamp = parse_clipping_added(clipping.added).timestamp()
-    return abs(clippingTimestamp - vocab.timestamp/1000)
-
-
-def getVocab(clipping, vocabs):
-    foundVocab = None
-    possibleUsages = []
-    distances = []
-    for index, vocab in enumerate(vocabs):
-        if clipping.content in vocab.usage:
-            distance = getTimestampDistance(clipping, vocab)
-            possibleUsages.append(vocab)
-            distances.append(distance)
-            
-    if possibleUsages:
-        minIndex = distances.index(min(distances))
-        foundVocab = possibleUsages[minIndex]
-        vocabDebug("distance", vocabs, clipping, foundVocab, distances)
-
-    return foundVocab, vocabs
-
-
-def isUnique(newNote, pendingNotes):
-    sentence_field = CONFIG['sentence_field']
-    word_field = CONFIG['word_field']
-    for pendingNote in pendingNotes:
-        pn = pendingNote['note']
-        if newNote[sentence_field] == pn[sentence_field] and newNote[word_field] == pn[word_field]:
-            return False
-    return True
+def existingNoteKeys(model, fieldNames, progress=None):
+    # notes.csum only covers a note's first field, so read the two fields we key
+    # on from every note of this type once and look each new note up in O(1).
+    # Runs on the import thread: the collection is read on the main thread a
+    # batch of notes at a time, in id order, and hashed here in between.
+    sentenceOrd = fieldNames.index(CONFIG['sentence_field'])
+    wordOrd = fieldNames.index(CONFIG['word_field'])
+    keys = set()
+    lastId = 0
+    while True:
+        rows = onMain(mw.col.db.all, 'select id, flds from notes where mid = ? and id > ? order by id limit ?', model['id'], lastId, NOTE_KEY_BATCH)
+        for nid, flds in rows:
+            values = splitFields(flds)
+            keys.add(noteKeyOf(values[sentenceOrd], values[wordOrd]))
+        if len(rows) < NOTE_KEY_BATCH:
+            return keys
+        lastId = rows[-1][0]
+        if progress:
+            progress.check()
 
 
 def setupCache():
@@ -256,7 +190,11 @@ def setupCache():
 
 
 def removeCache(cache):
-    del cache
+    cache.close()
+
+
+def cleanVocab(v):
+    return coreVocab.cleanVocab(v, VALID_WORDS or setupCache())
 
 def showProgressOrFinish(update=False, **kwargs):
     if not DEBUG:
@@ -268,6 +206,69 @@ def showProgressOrFinish(update=False, **kwargs):
             mw.progress.finish()
 
 
+class ImportCancelled(Exception):
+    pass
+
+
+class ClippingsNotFound(Exception):
+    pass
+
+
+ImportResult = namedtuple('ImportResult', ('stats', 'addedNotes', 'no_vocab', 'duplicates', 'resumed', 'metrics'))
+
+
+def wantCancel():
+    want_cancel = getattr(mw.progress, 'want_cancel', None)
+    if want_cancel:
+        return want_cancel()
+    # Older versions only flag it on the dialog when it's closed or Esc is pressed
+    win = getattr(mw.progress, '_win', None)
+    return bool(win and getattr(win, 'wantCancel', False))
+
+
+class ImportProgress:
+    # Passes progress from the import thread to the main window no more than once
+    # every PROGRESS_INTERVAL seconds, and picks up a cancel request while there
+    def __init__(self):
+        self.cancelled = threading.Event()
+        self._lastUpdate = 0
+
+    def update(self, label, value=None, force=False):
+        now = time.monotonic()
+        if not force and now - self._lastUpdate < PROGRESS_INTERVAL:
+            return
+        self._lastUpdate = now
+        kwargs = {'label': label}
+        if value is not None:
+            kwargs['value'] = value
+        mw.taskman.run_on_main(lambda: self._show(kwargs))
+
+    def _show(self, kwargs):
+        if wantCancel():
+            self.cancelled.set()
+        showProgressOrFinish(True, **kwargs)
+
+    def cancel(self, button=None):
+        # The import thread stops at its next check, after the chunk it's on
+        self.cancelled.set()
+        if button:
+            button.setEnabled(False)
+            button.setText('Cancelling...')
+
+    def addCancelButton(self):
+        # Anki's progress window only cancels on Esc or when it's closed, and
+        # says neither, so it gets a button for it
+        win = getattr(mw.progress, '_win', None)
+        if not win or not win.layout():
+            return
+        button = QPushButton('Cancel', win)
+        button.setAutoDefault(False)
+        button.clicked.connect(lambda: self.cancel(button))
+        win.layout().addWidget(button)
+
+    def check(self):
+        if self.cancelled.is_set():
+            raise ImportCancelled()
 
 
 def import_highlights():
@@ -284,192 +285,106 @@ def import_highlights():
     # mw.progress.start(label='Scanning Highlights...\n ', min=1, immediate=True)
     showProgressOrFinish(label='Scanning Highlights...\n ', min=1, immediate=True)
     path = os.path.join(CONFIG['path'], 'documents', 'My Clippings.txt')
-    try:
-        highlight_clippings, clippings_to_add, bad_clippings, clippings = getClippings(path)
-    except FileNotFoundError:
-        # mw.progress.finish()
-        showProgressOrFinish()
-        showInfo(f'Your file path to your Kindle could not be loaded. Does this file exist: {path} ?')
-        return
-
-    cache = setupCache()
-    timestamp = None
-    no_vocab = []
-    vocabs = getVocabLookups()
-    vocabDebug("original", vocabs)
-    clippings_to_add.reverse()
-    # mw.progress.update(label='Parsing New Highlights...\n ')
-    showProgressOrFinish(True, label='Parsing New Highlights...\n ')
-    pendingNotes = []
-    for i, clipping in enumerate(clippings_to_add):
-        # mw.progress.update(label=f'Parsing New Highlights...\n {clipping.content}', value=i+1)
-        showProgressOrFinish(True, label=f'Parsing New Highlights...\n {clipping.content}', value=i+1)
-        note = Note(mw.col, model)
-        # showInfo(str(len(vocabs)))
-        vocabDebug("before", vocabs, clipping)
-        vocab, vocabs = getVocab(clipping, vocabs)
-        if not vocab:
-            no_vocab.append(str(clipping))
-            vocabDebug("notFound", vocabs, clipping)
-            continue            
-        # showInfo(clipping.content +' '+ str(vocab))
-        vocabDebug("after", vocabs, clipping, vocab)
-
-        note.fields = list(fields(clipping, model, vocab))
-        note.addTag(vocab.authors)
-        note.addTag(vocab.title)
-        if not pendingNotes or isUnique(note, pendingNotes):
-            pendingNotes.append({"note":note,"vocab":vocab})
-    
-    # Create them in the order they were read
-    pendingNotes.reverse()
-    for pendingNote in pendingNotes:
-        pn = pendingNote['note']
-        mw.col.addNote(pn)
-        cids = [c.id for c in pn.cards()]
-        dm = DeckManager(mw.col)
-        deckId = getDeck(pendingNote['vocab'])
-        dm.setDeck(cids, deckId)
-        pn.flush()
-
-    showProgressOrFinish()
-    # mw.progress.finish()
-
-    if no_vocab :
-        showText(
-            f'The following {len(no_vocab)} clippings could not be matched automatically:\n\n' +
-            '\n==========\n'.join(no_vocab))
-
-    if clippings_to_add:
-        setLastAdded(clippings_to_add[0].added)
-    displayResults(highlight_clippings, clippings_to_add, bad_clippings, clippings, pendingNotes)
-    
-    removeCache(cache)
-
-
-
-def parse_text_clippings(file):
-    clippings = []
-    bad_clippings = []
-
-    current_clipping_lines = []
-    for line in file:
-        if line != '==========\n':
-            current_clipping_lines.append(line)
-            continue
-
-        string = ''.join(current_clipping_lines)
-        current_clipping_lines.clear()
-
-        clipping = parse_text_clipping(string)
-
-        if clipping:
-            # get around blank highlights; seems to be a kindle bug; Also don't want to bug the user with calling it a bad_clipping
-            if clipping.content:
-                clippings.append(clipping)
-        else:
-            if "ブックマーク" not in string:
-                bad_clippings.append(string)
-
-    if current_clipping_lines:
-        bad_clippings.append(''.join(current_clipping_lines))
-
-    return clippings, bad_clippings
-
+    fieldNames = mw.col.models.fieldNames(model)
+    progress = ImportProgress()
+    if not DEBUG:
+        progress.addCancelButton()
 
-def parse_text_clipping(string):
+    def onDone(future):
+        showProgressOrFinish()
+        try:
+            result = future.result()
+        except ClippingsNotFound:
+            log.close()
+            showInfo(f'Your file path to your Kindle could not be loaded. Does this file exist: {path} ?')
+            return
+        except ImportCancelled:
+            log.info('import cancelled')
+            log.close()
+            showInfo('Import cancelled. Highlights already added will be skipped when you import again.')
+            return
+        except Exception as e:
+            log.error('import failed', error=repr(e))
+            log.close()
+            raise
+        finishImport(result)
 
-    match = re.fullmatch(CLIPPING_PATTERN, string)
-    if not match:
-        return None
-    return Clipping(**match.groupdict())
+    mw.taskman.run_in_background(lambda: collectNotes(path, model, fieldNames, progress), onDone)
 
-CLIPPING_PATTERN = r'''\ufeff?(?P<document>.*)
-- ((?P<page>.*)?ページ\|)?位置No\. (?P<location>.*)?の(?:(?P<kind>.*) \|)?作成日: (?P<added>.*)
 
-(?P<content>.*)
-?'''
+def onMain(fn, *args):
+    # Runs fn on the main thread and waits for it, for collection writes from the import thread
+    future = Future()
 
-# It could be bookmarks too - which would break
-def highlights_only(clippings):
-    for clipping in clippings:
-        if 'ハイライト' in clipping.kind.lower():
-            yield clipping
+    def run():
+        try:
+            future.set_result(fn(*args))
+        except BaseException as e:
+            future.set_exception(e)
 
-def deinflectVocab(vocab):
+    mw.taskman.run_on_main(run)
+    return future.result()
 
-    if VALID_WORDS.contains(vocab):
-        return vocab
 
-    # Use basic deconjugation rules to guess a word
-    deconjugations = deconjugate(vocab)
-    for dc in deconjugations:
-        if VALID_WORDS.contains(dc):
-            return dc
-    
-    # Resort to mecab breaking things into individual words
-    try:
-        splitter = Splitter()
-        wordItems = splitter.analyze(vocab)
-        # if vocab != wordItems:
-        #     showInfo(vocab + ' ' + str(wordItems))
-        global MECABHITS 
-        MECABHITS += 1
-        return wordItems
-        # for splitWord in wordItems[1::2]:
-        #     # print(splitWord, VALID_WORDS.contains(splitWord))
-        #     if VALID_WORDS.contains(splitWord):
-        #         # if vocab == 'ぎいぎいと':
-        #         showInfo(str(wordItems) + ' '+ splitWord)
-        #         return splitWord
-    except Exception as e:
-        pass
-        raise Exception(str(e)+"\nCan't do sentence scan: check Japanese Support is installed and working properly")
-
-
-
-    return vocab
-
-def removeExtraChars(v):
-    regex = u'([\u4E00-\u9FFF]|[\u3040-\u309Fー]|[\u30A0-\u30FF])+'
-    match = re.search(regex, v, re.U)
+def collectNotes(path, model, fieldNames, progress):
+    # Runs off the main thread. The pipeline hands back each chunk's notes once
+    # they're built; they're committed and journaled here before the next chunk
+    # is read, so a run that dies partway picks up after the last committed
+    # chunk next time.
+    stats = ClippingStats()
+    pipeline = HighlightPipeline(CONFIG, MIRROR_PATH, log, debug=vocabDebug if DEBUG else None)
     try:
-        return match[0]
-    except TypeError: # things like ａｍｐｍ
-        return v
-
-def cleanVocab(v):
-    # cleaned = "".join(c for c in v if c not in BLACKLIST)
-    cleaned = removeExtraChars(v)
-    deinflected = deinflectVocab(cleaned)
-    return deinflected
-
-def fields(clipping, model, vocab):
-    content_yielded = False
-    source_yielded = False
-    word_yielded = False
-
-    for field in mw.col.models.fieldNames(model):
-        if field == CONFIG['sentence_field']:
-            yield vocab.usage.strip()
-            content_yielded = True
-        elif field == CONFIG['source_field']:
-            pg = 'ページ' + clipping.page if clipping.page is not None else ''
-            loc = '位置' + clipping.location if clipping.location is not None else ''
-            yield '{page}{added}{word}'.format(
-                page= pg if pg else loc,
-                added=' ' + clipping.added if clipping.added is not None else '',
-                word=' ' + clipping.content
-            )
-            source_yielded = True
-        elif field == CONFIG['word_field']:
-            yield cleanVocab(clipping.content)
-            word_yielded = True
-        else:
-            yield ''
+        clippingStream = pipeline.clippings(path, stats)
+    except FileNotFoundError:
+        raise ClippingsNotFound(path)
+
+    journal = ImportJournal(JOURNAL_PATH)
+    committed = journal.load()
+    progress.update('Checking Existing Notes...\n ', force=True)
+    seenKeys = existingNoteKeys(model, fieldNames, progress)
+    progress.update('Loading Vocab Lookups...\n ', force=True)
+    pipeline.sync()
+    progress.check()
+    # mw.progress.update(label='Parsing New Highlights...\n ')
+    progress.update('Parsing New Highlights...\n ', force=True)
+    no_vocab = []
+    addedNotes = 0
+    duplicates = 0
+    resumed = 0
+
+    # Oldest first, so notes are created in the order they were read
+    for result in pipeline.chunks(clippingStream, fieldNames, seenKeys, committed, progress):
+        no_vocab.extend(str(clipping) for clipping in result.no_vocab)
+        duplicates += result.duplicates
+        resumed += result.resumed
+        log.info('chunk committed', notes=len(result.notes), unmatched=len(result.no_vocab), duplicates=result.duplicates, resumed=result.resumed)
+        with pipeline.metrics.stage('commit', len(result.notes)):
+            if result.notes:
+                if not addedNotes:
+                    onMain(mw.checkpoint, 'Import Kindle Highlights')
+                onMain(writeNotes, model, result.notes)
+                addedNotes += len(result.notes)
+            journal.append(result.keys)
+        progress.check()
+
+    return ImportResult(stats, addedNotes, no_vocab, duplicates, resumed, pipeline.metrics)
+
+
+def finishImport(result):
+    if result.no_vocab :
+        showText(
+            f'The following {len(result.no_vocab)} clippings could not be matched automatically:\n\n' +
+            '\n==========\n'.join(result.no_vocab))
 
-    if not (content_yielded and source_yielded and word_yielded):
-        raise ValueError('Could not find content and/or source fields in model.')
+    setLastAdded(result.stats.last_added, result.stats.checkpoint)
+    ImportJournal(JOURNAL_PATH).clear()
+    log.info('import finished', added=result.addedNotes, **result.metrics.report())
+    log.close()
+    try:
+        result.metrics.write(reportPath)
+    except OSError as e:
+        log.warning(f'Could not write the import report to {reportPath}: {e}')
+    displayResults(result.stats, result.addedNotes, result.duplicates, result.resumed, result.metrics)
 
 
 # import kindleImporter